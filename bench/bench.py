@@ -0,0 +1,265 @@
+"""Runs the benchmark corpus against built fish-jit executables."""
+from __future__ import print_function
+
+import argparse
+import hashlib
+import json
+import os
+import platform
+import re
+import sys
+import tempfile
+import time
+
+PROGRAMS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'programs')
+INPUT_SIZE = 1 << 22
+
+STEPS = re.compile(br'^  (\d+) instructions,', re.M)
+
+# name, description, reads input
+BENCHMARKS = [
+  ('count',     'tight counting loop to 10**7',                 False),
+  ('factorial', 'bigint factorial of 3000',                     False),
+  ('fibonacci', 'bigint fibonacci of 50000',                    False),
+  ('harmonic',  'exact harmonic sum to 2000',                   False),
+  ('shuffle',   '$ @ { } r : ~ on a small stack, 10**6 times',  False),
+  ('nesting',   '[ ] over 1001 items, 10**4 frames deep',       False),
+  ('selfmod',   'p rewrites the next cell, 10**6 times',        False),
+  ('cat',       'copy input to output',                         True),
+  ('wc',        'count lines and bytes of input',               True),
+]
+
+WORDS = ('the quick brown fox jumps over a lazy dog while five '
+         'wizards box and jolly maidens sing of fish').split()
+
+
+def make_input(path, size):
+  """Writes `size` bytes of deterministic text, in lines of varying length."""
+  chunks, total, state = [], 0, 1
+  while total < size:
+    line = []
+    for _ in range(4 + state % 9):
+      state = (state * 1103515245 + 12345) & 0x7fffffff
+      line.append(WORDS[(state >> 16) % len(WORDS)])
+    line = ' '.join(line) + '\n'
+    chunks.append(line)
+    total += len(line)
+  with open(path, 'wb') as f:
+    f.write(''.join(chunks)[:size].encode('ascii'))
+
+
+def file_sha1(path):
+  h = hashlib.sha1()
+  with open(path, 'rb') as f:
+    for block in iter(lambda: f.read(1 << 16), b''):
+      h.update(block)
+  return h.hexdigest()
+
+
+def execute(binary, script, input_path, options=()):
+  """Returns (exit status, seconds, peak rss in KiB, sha1 of the output)."""
+  with open(input_path, 'rb') as stdin:
+    with tempfile.TemporaryFile() as stdout:
+      with open(os.devnull, 'wb') as stderr:
+        start = time.time()
+        pid = os.fork()
+        if pid == 0:
+          os.dup2(stdin.fileno(), 0)
+          os.dup2(stdout.fileno(), 1)
+          os.dup2(stderr.fileno(), 2)
+          try:
+            os.execv(binary, [binary] + list(options) + [script])
+          finally:
+            os._exit(127)
+        _, status, usage = os.wait4(pid, 0)
+        elapsed = time.time() - start
+      stdout.seek(0)
+      digest = hashlib.sha1(stdout.read()).hexdigest()
+  if os.WIFEXITED(status):
+    status = os.WEXITSTATUS(status)
+  else:
+    status = -os.WTERMSIG(status)
+  rss = usage.ru_maxrss
+  if sys.platform == 'darwin':
+    rss //= 1024
+  return status, elapsed, rss, digest
+
+
+def count_steps(binary, script, input_path, workdir):
+  """Returns the steps counted by `--profile`, or None."""
+  profile = os.path.join(workdir, 'profile.txt')
+  execute(binary, script, input_path, ['--profile', '--profile-file=' + profile])
+  try:
+    with open(profile, 'rb') as f:
+      match = STEPS.search(f.read())
+  except IOError:
+    return None
+  finally:
+    if os.path.exists(profile):
+      os.remove(profile)
+  if match is None:
+    return None
+  return int(match.group(1))
+
+
+def median(values):
+  values = sorted(values)
+  mid = len(values) // 2
+  if len(values) % 2:
+    return values[mid]
+  return (values[mid - 1] + values[mid]) / 2.0
+
+
+def run(args):
+  builds = []
+  for spec in args.build:
+    name, sep, path = spec.partition('=')
+    if not sep:
+      name, path = os.path.basename(spec), spec
+    if not os.access(path, os.X_OK):
+      print('not an executable: %s' % path, file=sys.stderr)
+      return 2
+    builds.append((name, os.path.abspath(path)))
+
+  selected = [b for b in BENCHMARKS if not args.only or b[0] in args.only]
+  workdir = tempfile.mkdtemp(prefix='fish-bench-')
+  input_path = os.path.join(workdir, 'input.txt')
+  make_input(input_path, INPUT_SIZE)
+
+  report = {
+    'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    'host': platform.node(),
+    'platform': platform.platform(),
+    'runs': args.runs,
+    'warmup': args.warmup,
+    'builds': {},
+    'results': {},
+  }
+  steps = {}
+  try:
+    for bench, _, reads_input in selected:
+      script = os.path.join(PROGRAMS, bench + '.fish')
+      stdin = input_path if reads_input else os.devnull
+      steps[bench] = count_steps(builds[0][1], script, stdin, workdir)
+    for name, path in builds:
+      report['builds'][name] = {'path': path, 'sha1': file_sha1(path)}
+      results = report['results'][name] = {}
+      for bench, description, reads_input in selected:
+        script = os.path.join(PROGRAMS, bench + '.fish')
+        stdin = input_path if reads_input else os.devnull
+        for _ in range(args.warmup):
+          execute(path, script, stdin)
+        times, rss, statuses, digests = [], [], set(), set()
+        for _ in range(args.runs):
+          status, elapsed, peak, digest = execute(path, script, stdin)
+          times.append(elapsed)
+          rss.append(peak)
+          statuses.add(status)
+          digests.add(digest)
+        best = min(times)
+        count = steps[bench]
+        results[bench] = {
+          'wall': times,
+          'best': best,
+          'median': median(times),
+          'steps': count,
+          'steps_per_sec': count / best if count and best > 0 else 0.0,
+          'peak_rss_kb': max(rss),
+          'status': max(statuses, key=abs),
+          'output_sha1': sorted(digests)[0] if len(digests) == 1 else None,
+        }
+        r = results[bench]
+        print('%-8s %-10s %9.3fs %10.3g steps/s %8d KiB%s' % (
+          name, bench, r['median'], r['steps_per_sec'], r['peak_rss_kb'],
+          '' if r['status'] == 0 else '  exit %d' % r['status']), file=sys.stderr)
+  finally:
+    os.remove(input_path)
+    os.rmdir(workdir)
+
+  if args.output:
+    with open(args.output, 'w') as f:
+      json.dump(report, f, indent=2, sort_keys=True)
+  else:
+    json.dump(report, sys.stdout, indent=2, sort_keys=True)
+    print()
+  return 0
+
+
+def load_results(spec):
+  """Loads FILE or FILE:BUILD, and returns a dict of build name to results."""
+  path, build = spec, None
+  if not os.path.exists(path) and ':' in path:
+    path, build = spec.rsplit(':', 1)
+  with open(path) as f:
+    results = json.load(f)['results']
+  if build is None:
+    return results
+  if build not in results:
+    raise KeyError('no build named %r in %s' % (build, path))
+  return {build: results[build]}
+
+
+def compare(args):
+  base, new = load_results(args.base), load_results(args.new)
+  if len(base) == 1 and len(new) == 1:
+    pairs = [(list(base)[0], list(new)[0])]
+  else:
+    pairs = [(name, name) for name in sorted(base) if name in new]
+  if not pairs:
+    print('no builds in common', file=sys.stderr)
+    return 2
+
+  failed = False
+  for base_name, new_name in pairs:
+    print('%s -> %s' % (base_name, new_name))
+    print('  %-10s %10s %10s %8s %12s %12s' % ('', 'base', 'new', 'ratio', 'base rss', 'new rss'))
+    old_results, new_results = base[base_name], new[new_name]
+    for bench, _, _ in BENCHMARKS:
+      if bench not in old_results or bench not in new_results:
+        continue
+      old, cur = old_results[bench], new_results[bench]
+      ratio = cur['median'] / old['median'] if old['median'] > 0 else 1.0
+      notes = []
+      if ratio > 1 + args.threshold:
+        notes.append('SLOWER')
+        failed = True
+      elif ratio < 1 - args.threshold:
+        notes.append('faster')
+      if cur['status'] != 0:
+        notes.append('EXIT %d' % cur['status'])
+        failed = True
+      elif cur['output_sha1'] != old['output_sha1']:
+        notes.append('OUTPUT CHANGED')
+        failed = True
+      print('  %-10s %9.3fs %9.3fs %7.2fx %8d KiB %8d KiB  %s' % (
+        bench, old['median'], cur['median'], ratio,
+        old['peak_rss_kb'], cur['peak_rss_kb'], ' '.join(notes)))
+  return 1 if failed else 0
+
+
+def main(argv):
+  parser = argparse.ArgumentParser(description='fish-jit benchmarks')
+  commands = parser.add_subparsers(dest='command')
+  p = commands.add_parser('run', help='run the corpus against one or more builds')
+  p.add_argument('--build', action='append', required=True, metavar='[NAME=]PATH',
+                 help='an executable to benchmark, may be repeated')
+  p.add_argument('--runs', type=int, default=5, help='timed runs per benchmark (default 5)')
+  p.add_argument('--warmup', type=int, default=1, help='untimed runs per benchmark (default 1)')
+  p.add_argument('--only', action='append', metavar='NAME', help='run only the named benchmark')
+  p.add_argument('-o', '--output', help='write results to this file, rather than stdout')
+  p = commands.add_parser('compare', help='compare the results of two runs')
+  p.add_argument('base', metavar='BASE', help='results file, or FILE:BUILD')
+  p.add_argument('new', metavar='NEW', help='results file, or FILE:BUILD')
+  p.add_argument('--threshold', type=float, default=0.05,
+                 help='relative change in median time to report (default 0.05)')
+  args = parser.parse_args(argv[1:])
+  if args.command == 'run':
+    return run(args)
+  if args.command == 'compare':
+    return compare(args)
+  parser.print_help()
+  return 2
+
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv))
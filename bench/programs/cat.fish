@@ -0,0 +1 @@
+i:0(?;o
@@ -0,0 +1,3 @@
+0aa*:*:*a,v
+          >$1+$1-:?!v
+                    >~n;
@@ -0,0 +1,3 @@
+13aa*a**v
+        >:@*$1-:?!v
+                  >~n;
@@ -0,0 +1,3 @@
+01aa*:*5*v
+         >&:@+&1-:?!v
+                    >~~n;
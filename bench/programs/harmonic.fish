@@ -0,0 +1,3 @@
+0aa*a*2*v
+        >:1$,@&+&1-:?!v
+                      >~n;
@@ -0,0 +1,7 @@
+aa*a*v
+     >:1-:?!v
+            >aa*:*v
+                  >1-l[:?!v
+                          >~aa*:*v
+                                 >]1-:?!v
+                                        >~ln;
@@ -0,0 +1,3 @@
+0aa*a*:*  v
+          >:2%"0"+f8+1p0@&+&1-:?!v
+                                 >~n;
@@ -0,0 +1,3 @@
+123aa*a*:*v
+          >&$@{}r:~&1-:?!v
+                         >~nnn;
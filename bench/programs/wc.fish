@@ -0,0 +1,3 @@
+00v
+  >i:0(?va=$1+@+$
+        >~$n" "onao;
@@ -1,146 +1,467 @@
 import os
+import stat
 
+from rpython.rlib import jit
 from rpython.rlib.jit import JitDriver
-from rpython.rlib.rarithmetic import r_uint64
-from rpython.rlib.rrandom import Random
-from rpython.rlib.rtime import time
-from rpython.rlib.rutf8 import Utf8StringIterator, unichr_as_utf8, codepoint_at_pos
+from rpython.rlib.objectmodel import we_are_translated
+from rpython.rlib.rarithmetic import string_to_int
+from rpython.rlib.rsha import RSHA
+from rpython.rlib.rsignal import pypysig_ignore, pypysig_setflag, SIGINT, SIGPIPE, SIGTERM
+from rpython.rlib.rsocket import RSocket, UNIXAddress, SocketError, AF_UNIX, SOCK_STREAM
+from rpython.rlib.rstring import ParseStringError
+from rpython.rlib.rtime import sleep, time
+from rpython.rlib.rutf8 import Utf8StringIterator, unichr_as_utf8
 
-from rbigfrac import rbigfrac, ZERO
+from rbigfrac import RATIONALS
+from rblock import rblock, rblockcache, NO_BLOCK, K_PUSH, K_DYADIC, K_DYADIC_CONST, K_STACK, K_EXEC, K_EXTEND
 from rdeque import rdeque
+from rdouble import DOUBLES
+from rgrid import rgrid
+from rinteger import INTEGERS
+from rjitstats import rjitstats, rjithooks
+from rpool import rpool
+from rprng import rprng
+from rprofile import rprofile
+from rsignals import Interrupted, watch_signals, unwatch_signals, poll_signals, stop_requested, NO_REQUEST, STOP
+from rsnapshot import rsnapshot, Stopped, read_snapshot, write_snapshot
+from rstack import rstack
+from rstackfile import read_stack_file, FORMATS
+from rstdio import rreader, rwriter, write_all, DEFAULT_BUFFER_SIZE
+from rtrace import rtrace, error_name
+
+def get_location(pcx, pcy, dx, dy, program, blocks):
+  if dx > 0:   arrow = '>'
+  elif dy > 0: arrow = 'v'
+  elif dx < 0: arrow = '<'
+  else:        arrow = '^'
+  return '%d,%d %s' % (pcx, pcy, arrow)
 
 jitdriver = JitDriver(
-  greens = ['pcx', 'pcy', 'dx', 'dy'],
-  reds   = 'auto'
+  greens = ['pcx', 'pcy', 'dx', 'dy', 'program', 'blocks'],
+  reds   = ['skip', 'slurp', 'slurp_char', 'countdown', 'since', 'no_prng', 'read_func',
+            'register', 'registers', 'prng', 'input', 'output', 'profile', 'stack'],
+  virtualizables = ['stack'],
+  get_printable_location = get_location
 )
 
+JIT_STATS = rjitstats()
+JIT_HOOKS = rjithooks(JIT_STATS)
+TRACE = rtrace()
+
 
-T_NOUN, T_DYADIC, T_STACK, T_MIRROR, T_CONTROL, T_QUOTE, T_OTHER = range(7)
+T_NOUN, T_DYADIC, T_STACK, T_MIRROR, T_CONTROL, T_QUOTE, T_NOOP, T_OTHER = range(8)
 SYMBOLS = {
   T_NOUN:    '0123456789abcdef',
   T_DYADIC:  '%*+,-()=',
   T_STACK:   '$:@[]lr{}~',
   T_MIRROR:  '#/<>\\^_vx|',
-  T_CONTROL: '\0 !&.;?ginop',
-  T_QUOTE:   '"\''
+  T_CONTROL: '!&.;?ginop',
+  T_QUOTE:   '"\'',
+  T_NOOP:    '\0 '
 }
 TYPES = dict([(ord(c), t) for t, chars in SYMBOLS.items() for c in chars])
-NOUNS = dict([(ord(c), rbigfrac.fromint(int(c, 16))) for c in SYMBOLS[T_NOUN]])
+NOUNS = dict([(ord(c), int(c, 16)) for c in SYMBOLS[T_NOUN]])
+NUMERICS = dict([(n.name, n) for n in [RATIONALS, INTEGERS, DOUBLES]])
+MAX_BLOCK = 32
+MAX_STRING = 1 << 16
+MAX_SCRIPTS = 256
+CHECK_INTERVAL = 1 << 16
+MAX_ACCEPT_FAILURES = 12
+DEFAULT_CHECKPOINT = 'fish.checkpoint'
+
+
+class settings(object):
+  """Options fixed at startup, which traces treat as constants."""
+  _immutable_fields_ = ['profiling?', 'tracing?', 'numeric?', 'decimals?', 'checkpoint_file?',
+                        'checkpoint_every?', 'checkpoint_span?']
+
+  def __init__(self):
+    self.profiling = False
+    self.tracing = False
+    self.numeric = RATIONALS
+    self.decimals = -1
+    self.checkpoint_file = ''
+    self.checkpoint_every = 0
+    self.checkpoint_span = 0
+    self.seeded = False
+    self.seed = 0
 
+  def checkpoint(self, path, every):
+    """Writes snapshots to `path` every `every` steps, and on signal."""
+    self.checkpoint_file = path
+    self.checkpoint_every = every
+    self.checkpoint_span = CHECK_INTERVAL
+    if 0 < every < CHECK_INTERVAL:
+      self.checkpoint_span = every
 
-def read_char():
-  char = os.read(0, 1)
-  if char:
-    return ord(char[0])
-  return -1
+SETTINGS = settings()
 
-def read_unichar():
+
+def read_char(input):
+  return input.read_byte()
+
+def read_unichar(input):
   """Assumes utf-8 input, latin1 will be mangled.
   """
-  char = os.read(0, 1)
-  if char:
-    code = ord(char[0])
-    if code < 0x80:
-      return code
-    elif code < 0xC0:
+  code = input.read_byte()
+  if code < 0x80:
+    return code
+  elif code < 0xC0:
+    raise UnicodeDecodeError
+  elif code < 0xE0:
+    code, n = code & 0x1F, 1
+  elif code < 0xF0:
+    code, n = code & 0x0F, 2
+  else:
+    code, n = code & 0x07, 3
+  for _ in range(n):
+    byte = input.read_byte()
+    if byte < 0:
       raise UnicodeDecodeError
-    elif code < 0xE0:
-      return codepoint_at_pos(char + os.read(0, 1), 0)
-    elif code < 0xF0:
-      return codepoint_at_pos(char + os.read(0, 2), 0)
-    return codepoint_at_pos(char + os.read(0, 3), 0)
-  return -1
+    code = (code << 6) | (byte & 0x3F)
+  return code
+
+
+def dyadic(code, a, b):
+  if   code ==  37: return a.mod(b)
+  elif code ==  42: return a.mul(b)
+  elif code ==  43: return a.add(b)
+  elif code ==  44: return a.div(b)
+  elif code ==  45: return a.sub(b)
+  elif code ==  40: return SETTINGS.numeric.frombool(a.lt(b))
+  elif code ==  41: return SETTINGS.numeric.frombool(a.gt(b))
+  elif code ==  61: return SETTINGS.numeric.frombool(a.eq(b))
+  return SETTINGS.numeric.fromint(0)
+
+def shuffle(code, stack):
+  if code == 36:
+    stack.swap()
+  elif code == 58:
+    stack.dup()
+  elif code == 64:
+    stack.rot3()
+  elif code == 108:
+    stack.append(SETTINGS.numeric.fromint(stack.len()))
+  elif code == 114:
+    stack.reverse()
+  elif code == 123:
+    stack.roll(-1)
+  elif code == 125:
+    stack.roll(1)
+  elif code == 126:
+    stack.pop()
+
+def control(code, stack, program, blocks, input, read_func, output):
+  if code == 103:
+    y, x = stack.pop().toint(), stack.pop().toint()
+    v, _ = program.get(x, y)
+    stack.append(SETTINGS.numeric.fromint(v))
+  elif code == 105:
+    output.flush()
+    char = read_func(input)
+    stack.append(SETTINGS.numeric.fromint(char))
+  elif code == 110:
+    n = stack.pop()
+    n.write(output, SETTINGS.decimals)
+  elif code == 111:
+    n = stack.pop().toint()
+    if n >= 0:
+      output.write(unichr_as_utf8(n))
+    else:
+      raise UnicodeError('utf-8', 'out of range', n)
+  elif code == 112:
+    y, x, v = stack.pop().toint(), stack.pop().toint(), stack.pop().toint()
+    if v in TYPES:
+      t = TYPES[v]
+    else:
+      t = T_OTHER
+    if program.put(x, y, v, t):
+      blocks.invalidate(x, y)
+
+
+def scan_string(program, x, y, dx, dy, quote):
+  """Returns the values of the string literal at (x, y), and its end."""
+  string = []
+  cx, cy = program.step(x, y, dx, dy)
+  while True:
+    code, _ = program.get(cx, cy)
+    if code == quote:
+      return string, cx, cy
+    if len(string) >= MAX_STRING:
+      return None, x, y
+    string.append(SETTINGS.numeric.fromint(code))
+    cx, cy = program.step(cx, cy, dx, dy)
+
+
+def compile_block(program, x, y, dx, dy):
+  """Compiles the straight-line run of instructions from (x, y)."""
+  kinds, codes, values, strings, steps, xs, ys = [], [], [], [], [], [], []
+  size = 0
+  cells = 0
+  pending = 0
+  last_x, last_y = x, y
+  cx, cy = x, y
+  for _ in range(MAX_BLOCK):
+    code, type = program.get(cx, cy)
+    n = len(kinds)
+    if type == T_NOOP:
+      pending += 1
+    elif type == T_NOUN:
+      kinds.append(K_PUSH)
+      codes.append(code)
+      values.append(SETTINGS.numeric.digits[NOUNS[code]])
+      steps.append(pending + 1)
+      xs.append(cx)
+      ys.append(cy)
+    elif type == T_DYADIC:
+      if (n >= 2 and kinds[n-1] == K_PUSH and kinds[n-2] == K_PUSH and
+          not (code in (37, 44) and not values[n-1].tobool())):
+        b, a = values.pop(), values.pop()
+        codes.pop()
+        kinds.pop()
+        xs.pop()
+        ys.pop()
+        values.append(dyadic(code, a, b))
+        codes[n-2] = code
+        folded = steps.pop()
+        steps[n-2] += folded + pending + 1
+        xs[n-2] = cx
+        ys[n-2] = cy
+      elif n >= 1 and kinds[n-1] == K_PUSH:
+        kinds[n-1] = K_DYADIC_CONST
+        codes[n-1] = code
+        steps[n-1] += pending + 1
+        xs[n-1] = cx
+        ys[n-1] = cy
+      else:
+        kinds.append(K_DYADIC)
+        codes.append(code)
+        values.append(None)
+        steps.append(pending + 1)
+        xs.append(cx)
+        ys.append(cy)
+    elif type == T_STACK and code != 91 and code != 93:
+      if code == 58 and n >= 1 and kinds[n-1] == K_PUSH:
+        kinds.append(K_PUSH)
+        codes.append(code)
+        values.append(values[n-1])
+      else:
+        kinds.append(K_STACK)
+        codes.append(code)
+        values.append(None)
+      steps.append(pending + 1)
+      xs.append(cx)
+      ys.append(cy)
+    elif type == T_CONTROL and code in (103, 105, 110, 111, 112) and not (code == 105 and SETTINGS.checkpoint_span > 0):
+      # A stop requested while `i` waits is acted on at the `i` itself.
+      kinds.append(K_EXEC)
+      codes.append(code)
+      values.append(None)
+      steps.append(pending + 1)
+      xs.append(cx)
+      ys.append(cy)
+    elif type == T_QUOTE:
+      string, qx, qy = scan_string(program, cx, cy, dx, dy, code)
+      if string is None:
+        break
+      kinds.append(K_EXTEND)
+      codes.append(len(strings))
+      values.append(None)
+      strings.append(string)
+      size += 1
+      cells += len(string) + 1
+      steps.append(pending + len(string) + 2)
+      xs.append(cx)
+      ys.append(cy)
+      cx, cy = qx, qy
+    else:
+      break
+    if type != T_NOOP:
+      size += 1
+      pending = 0
+    cells += 1
+    last_x, last_y = cx, cy
+    if code == 112 and type == T_CONTROL:
+      break
+    cx, cy = program.jump(cx, cy, dx, dy)
+    if cx == x and cy == y:
+      break
+  if size < 2:
+    return NO_BLOCK
+  if pending > 0:
+    steps[len(steps) - 1] += pending  # blank cells after the last op
+  return rblock(kinds[:], codes[:], values[:], strings[:], steps[:], xs[:], ys[:], last_x, last_y, cells)
+
+def find_block(program, blocks, x, y, dx, dy):
+  """Returns the block entered at (x, y), compiling it on first use."""
+  version = program.current()
+  if version is None:
+    return lookup_block(program, blocks, x, y, dx, dy)
+  return lookup_block_at(program, blocks, x, y, dx, dy, version)
+
+@jit.elidable
+def lookup_block_at(program, blocks, x, y, dx, dy, version):
+  return lookup_block(program, blocks, x, y, dx, dy)
+
+def lookup_block(program, blocks, x, y, dx, dy):
+  block = blocks.get(x, y, dx, dy)
+  if block is None:
+    block = compile_block(program, x, y, dx, dy)
+    blocks.set(x, y, dx, dy, block)
+  return block
+
+def trace_op(block, i, dx, dy, frames, stack, program):
+  """Records op i of `block` in the crash trace, as it is about to run."""
+  x, y = block.xs[i], block.ys[i]
+  code = block.codes[i]
+  if block.kinds[i] == K_EXTEND:
+    code, _ = program.get(x, y)
+  TRACE.step(x, y, dx, dy, code, stack, frames)
+
+@jit.unroll_safe
+def run_block(block, dx, dy, frames, stack, program, blocks, input, read_func, output):
+  block = jit.promote(block)
+  for i in range(block.len()):
+    kind = block.kinds[i]
+    code = block.codes[i]
+    stack.steps += block.steps[i]
+    if SETTINGS.tracing:
+      trace_op(block, i, dx, dy, frames, stack, program)
+    if kind == K_PUSH:
+      stack.append(block.values[i])
+    elif kind == K_DYADIC:
+      b, a = stack.pop(), stack.pop()
+      stack.append(dyadic(code, a, b))
+    elif kind == K_DYADIC_CONST:
+      a = stack.pop()
+      stack.append(dyadic(code, a, block.values[i]))
+    elif kind == K_STACK:
+      shuffle(code, stack)
+    elif kind == K_EXTEND:
+      stack.extend(block.strings[code])
+    else:
+      control(code, stack, program, blocks, input, read_func, output)
+
+
+def checkpoint(program, pcx, pcy, dx, dy, skip, slurp, slurp_char, stack, registers, register, prng, output):
+  output.flush()
+  snapshot = rsnapshot(SETTINGS.numeric, program, pcx, pcy, dx, dy, skip, slurp, slurp_char,
+                       stack.frames(), registers, register, prng)
+  try:
+    write_snapshot(SETTINGS.checkpoint_file, snapshot.dump())
+  except OSError:
+    os.write(2, 'Cannot write checkpoint: %s\n'%SETTINGS.checkpoint_file)
 
 
-def run(program, col_max, row_max, stack, read_func, no_prng):
+class OutOfSteps(Exception):
+  """Raised when a script has used all of the steps allowed it."""
+  pass
+
+
+def run(program, blocks, stack, input, read_func, output, no_prng, profile, resume):
+  """Runs the codebox on `stack` until `;`, and returns its deque."""
   pcx, pcy = 0, 0
   dx, dy = 1, 0
-  stacks = []
   register = None
   registers = []
   skip = False
   slurp = False
   slurp_char = 0
-  prng = Random(r_uint64(time()*1000))
+  if SETTINGS.seeded:
+    prng = rprng.fromseed(SETTINGS.seed)
+  else:
+    prng = rprng.fromseed(int(time()*1000))
+  if resume is not None:
+    pcx, pcy, dx, dy = resume.pcx, resume.pcy, resume.dx, resume.dy
+    skip, slurp, slurp_char = resume.skip, resume.slurp, resume.slurp_char
+    register = resume.register
+    registers = resume.registers
+    prng = resume.prng
+  countdown = SETTINGS.checkpoint_span
+  since = 0
 
   while True:
     jitdriver.jit_merge_point(
-      pcx=pcx, pcy=pcy, dx=dx, dy=dy
+      pcx=pcx, pcy=pcy, dx=dx, dy=dy, program=program, blocks=blocks,
+      skip=skip, slurp=slurp, slurp_char=slurp_char, countdown=countdown, since=since,
+      register=register, registers=registers, prng=prng, input=input, read_func=read_func,
+      output=output, no_prng=no_prng, profile=profile, stack=stack
     )
 
-    if (pcx, pcy) in program:
-      code, type = program[(pcx, pcy)]
-    else:
-      code, type = 0, T_CONTROL
+    if SETTINGS.checkpoint_span > 0:
+      countdown -= 1
+      if countdown <= 0:
+        countdown = SETTINGS.checkpoint_span
+        since += countdown
+        request = poll_signals()
+        every = SETTINGS.checkpoint_every
+        if request != NO_REQUEST or (every > 0 and since >= every):
+          since = 0
+          checkpoint(program, pcx, pcy, dx, dy, skip, slurp, slurp_char, stack, registers, register, prng, output)
+          if request == STOP:
+            raise Stopped
+
+    if stack.limit > 0 and stack.steps >= stack.limit:
+      raise OutOfSteps
+
+    profiling = SETTINGS.profiling
+    tracing = SETTINGS.tracing
+
+    if not skip and not slurp and not profiling:
+      block = find_block(program, blocks, pcx, pcy, dx, dy)
+      if block is not NO_BLOCK and stack.fits(block.cells):
+        run_block(block, dx, dy, len(registers), stack, program, blocks, input, read_func, output)
+        pcx, pcy = program.jump(block.last_x, block.last_y, dx, dy)
+        continue
+
+    code, type = program.get(pcx, pcy)
+    stack.steps += 1
+
+    if tracing:
+      TRACE.step(pcx, pcy, dx, dy, code, stack, len(registers))
+
+    if profiling and not skip:
+      if slurp:
+        profile.step(pcx, pcy, dx, dy, slurp_char)
+      else:
+        profile.step(pcx, pcy, dx, dy, code)
 
     if skip:
       skip = False
 
     elif slurp:
       if code != slurp_char:
-        stack.append(rbigfrac.fromint(code))
+        stack.append(SETTINGS.numeric.fromint(code))
       else:
         slurp = False
         slurp_char = 0
 
+    elif type == T_NOOP:
+      pass
+
     elif type == T_NOUN:
-      stack.append(NOUNS[code])
+      stack.append(SETTINGS.numeric.digits[NOUNS[code]])
 
     elif type == T_DYADIC:
-      try:
-        b, a, o = stack.pop(), stack.pop(), ZERO
-        if   code ==  37: o = a.mod(b)
-        elif code ==  42: o = a.mul(b)
-        elif code ==  43: o = a.add(b)
-        elif code ==  44: o = a.div(b)
-        elif code ==  45: o = a.sub(b)
-        elif code ==  40: o = rbigfrac.frombool(a.lt(b))
-        elif code ==  41: o = rbigfrac.frombool(a.gt(b))
-        elif code ==  61: o = rbigfrac.frombool(a.eq(b))
-        stack.append(o)
-      except:
-        raise
+      b, a = stack.pop(), stack.pop()
+      stack.append(dyadic(code, a, b))
 
     elif type == T_STACK:
-      try:
-        if code == 36:
-          b, a = stack.pop(), stack.pop()
-          stack.extend([b, a])
-        elif code == 58:
-          stack.append(stack.top())
-        elif code == 64:
-          c, b, a = stack.pop(), stack.pop(), stack.pop()
-          stack.extend([c, a, b])
-        elif code == 91:
-          n = stack.pop().toint()
-          stacks.append(stack)
-          stack = rdeque(stack.popn(n))
-          registers.append(register)
+      if code == 91:
+        n = stack.pop().toint()
+        stack.open_frame(n)
+        registers.append(register)
+        register = None
+        if profiling:
+          profile.frame(len(registers))
+      elif code == 93:
+        if stack.close_frame():
+          register = registers.pop()
+        else:
+          stack.reset(rdeque())
           register = None
-        elif code == 93:
-          if len(stacks) >= 1:
-            tmpstack, stack = stack, stacks.pop()
-            stack.iadd(tmpstack)
-            register = registers.pop()
-          else:
-            stack = rdeque()
-            register = None
-        elif code == 108:
-          stack.append(rbigfrac.fromint(stack.len()))
-        elif code == 114:
-          stack.reverse()
-        elif code == 123:
-          if stack.len() > 1:
-            a = stack.popleft()
-            stack.append(a)
-        elif code == 125:
-          if stack.len() > 1:
-            a = stack.pop()
-            stack.appendleft(a)
-        elif code == 126:
-          stack.pop()
-      except:
-        raise
+      else:
+        shuffle(code, stack)
 
     elif type == T_MIRROR:
       if   code ==  35: dx, dy = (-dx, -dy)
@@ -152,60 +473,34 @@ def run(program, col_max, row_max, stack, read_func, no_prng):
       elif code ==  95: dx, dy = ( dx, -dy)
       elif code == 118: dx, dy = (  0,   1)
       elif code == 120 and not no_prng:
-        dx, dy = [(0, 1), (1, 0), (0, -1), (-1, 0)][int(prng.random() * 4)]
+        dx, dy = [(0, 1), (1, 0), (0, -1), (-1, 0)][prng.direction()]
       elif code == 124: dx, dy = (-dx,  dy)
 
     elif type == T_CONTROL:
-      try:
-        if code == 33:
-          skip = True
-        elif code == 38:
-          if register is None:
-            register = stack.pop()
-          else:
-            stack.append(register)
-            register = None
-        elif code == 46:
-          pcy, pcx = stack.pop().toint(), stack.pop().toint()
-        elif code == 59:
-          return stack
-        elif code == 63:
-          skip = not stack.pop().tobool()
-        elif code == 103:
-          y, x = stack.pop().toint(), stack.pop().toint()
-          if (x, y) in program:
-            stack.append(rbigfrac.fromint(program[(x, y)][0]))
-          else:
-            stack.append(ZERO)
-        elif code == 105:
-          char = read_func()
-          stack.append(rbigfrac.fromint(char))
-        elif code == 110:
-          n = stack.pop()
-          os.write(1, n.tostr())
-        elif code == 111:
-          n = stack.pop().toint()
-          if n >= 0:
-            os.write(1, unichr_as_utf8(n))
-          else:
-            raise UnicodeError('utf-8', 'out of range', n)
-        elif code == 112:
-          y, x, v = stack.pop().toint(), stack.pop().toint(), stack.pop().toint()
-          if v in TYPES:
-            t = TYPES[v]
-          else:
-            t = T_OTHER
-          program[(x, y)] = (v, t)
-          if x in col_max:
-            col_max[x] = max(col_max[x], y)
-          else:
-            col_max[x] = y
-          if y in row_max:
-            row_max[y] = max(row_max[y], x)
-          else:
-            row_max[y] = x
-      except:
-        raise
+      if code == 33:
+        skip = True
+      elif code == 38:
+        if register is None:
+          register = stack.pop()
+        else:
+          stack.append(register)
+          register = None
+      elif code == 46:
+        pcy, pcx = stack.pop().toint(), stack.pop().toint()
+      elif code == 59:
+        output.flush()
+        return stack.finish()
+      elif code == 63:
+        skip = not stack.pop().tobool()
+      else:
+        if profiling and code == 112 and stack.len() >= 3:
+          profile.write(stack.get(stack.len() - 2).toint(), stack.top().toint())
+        try:
+          control(code, stack, program, blocks, input, read_func, output)
+        except Interrupted:
+          poll_signals()
+          checkpoint(program, pcx, pcy, dx, dy, skip, slurp, slurp_char, stack, registers, register, prng, output)
+          raise Stopped
 
     elif type == T_QUOTE:
       slurp = True
@@ -214,62 +509,298 @@ def run(program, col_max, row_max, stack, read_func, no_prng):
     else:
       raise RuntimeError('Invalid instruction', code)
 
-    x = pcx + dx
-    if pcy in row_max:
-      rmax = row_max[pcy]
-    else:
-      rmax = 0
-    if x < 0 or x > rmax:
-      if dx < 0:
-        x = rmax
-      elif dx > 0:
-        x = 0
-
-    y = pcy + dy
-    if pcx in col_max:
-      cmax = col_max[pcx]
+    if skip or slurp:
+      pcx, pcy = program.step(pcx, pcy, dx, dy)
     else:
-      cmax = 0
-    if y < 0 or y > cmax:
-      if dy < 0:
-        y = cmax
-      elif dy > 0:
-        y = 0
-
-    pcx, pcy = x, y
+      pcx, pcy = program.jump(pcx, pcy, dx, dy)
 
 
 def parse(source):
-  lines = source.splitlines()
-  program = {}
-  col_max = {}
-  row_max = {}
+  """Builds the codebox for `source`, frozen if it has no `p`."""
+  lines = []
+  width = 0
+  writable = False
+  for line in source.splitlines():
+    codes = []
+    for c in Utf8StringIterator(line):
+      codes.append(c)
+      if c == 112:
+        writable = True
+    width = max(width, len(codes))
+    lines.append(codes)
+  program = rgrid(width, len(lines), T_NOOP, not writable)
   y = 0
-  for line in lines:
+  for codes in lines:
     x = 0
-    for c in Utf8StringIterator(line):
+    for c in codes:
       if c in TYPES:
         t = TYPES[c]
       else:
         t = T_OTHER
-      program[(x, y)] = (c, t)
-      if x in col_max:
-        col_max[x] = max(col_max[x], y)
-      else:
-        col_max[x] = y
-      if y in row_max:
-        row_max[y] = max(row_max[y], x)
-      else:
-        row_max[y] = x
+      program.put(x, y, c, t)
       x += 1
     y += 1
-  return program, col_max, row_max
+  program.build_jumps()
+  return program
+
+
+def run_program(name, source, stack, input, read_func, output, no_prng, reports, resume=None):
+  """Runs one script, and returns its stack, or None if it has failed."""
+  if resume is None:
+    runner = interpreter(name, source, read_func, no_prng)
+  else:
+    runner = interpreter.fromsnapshot(name, resume, read_func, no_prng)
+  stack = runner.run(stack, input, output)
+  if runner.stopped:
+    os.write(2, 'Stopped, checkpoint written to %s\n'%SETTINGS.checkpoint_file)
+  elif stack is None:
+    os.write(2, 'something smells fishy...\n')
+    if SETTINGS.tracing:
+      write_all(2, TRACE.report(name, runner.error, runner.steps))
+  if runner.report:
+    reports.append(runner.report)
+  return stack
+
+def write_reports(reports, filename):
+  if not filename:
+    write_all(2, ''.join(reports))
+    return
+  try:
+    fd = os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0644)
+  except OSError:
+    os.write(2, 'Cannot write profile: %s\n'%filename)
+    return
+  write_all(fd, ''.join(reports))
+  os.close(fd)
+
+
+class interpreter(object):
+  """A script, which keeps its codebox and traces from run to run."""
+  __slots__ = ['name', 'source', 'program', 'blocks', 'read_func', 'no_prng', 'resume',
+               'steps', 'error', 'stopped', 'report', 'output', 'stack']
+
+  def __init__(self, name, source, read_func = read_char, no_prng = False):
+    self.name = name
+    self.source = source
+    self.program = parse(source)
+    self.blocks = rblockcache(self.program.width, self.program.height)
+    self.read_func = read_func
+    self.no_prng = no_prng
+    self.resume = None
+    self.steps = 0
+    self.error = ''
+    self.stopped = False
+    self.report = ''
+    self.output = ''
+    self.stack = []
+
+  @staticmethod
+  def fromsnapshot(name, snapshot, read_func, no_prng):
+    """Continues the run saved in `snapshot`, on its first run."""
+    runner = interpreter(name, '', read_func, no_prng)
+    runner.program = snapshot.program
+    runner.blocks = rblockcache(runner.program.width, runner.program.height)
+    runner.resume = snapshot
+    return runner
+
+  def execute(self, values, data, budget = 0):
+    """Runs the script on `values` and `data`, returning True on `;`."""
+    output = rwriter.inmemory()
+    stack = self.run(rdeque(values), rreader.frombytes(data), output, budget)
+    self.output = output.getvalue()
+    if stack is None:
+      self.stack = []
+      return False
+    self.stack = [stack.get(i) for i in range(stack.len())]
+    return True
+
+  def run(self, stack, input, output, budget = 0):
+    """Runs the script on `stack`, and returns its stack, or None."""
+    resume = self.resume
+    if resume is not None:
+      self.resume = None
+      stack = resume.stack()
+    elif self.program.versions > 0:
+      self.program = parse(self.source)
+      self.blocks = rblockcache(self.program.width, self.program.height)
+    profile = None
+    if SETTINGS.profiling:
+      profile = rprofile(self.program.width, self.program.height)
+    state = rstack(stack, budget)
+    if SETTINGS.tracing:
+      TRACE.start(state)
+    self.error = ''
+    self.stopped = False
+    watching = SETTINGS.checkpoint_span > 0
+    if watching:
+      watch_signals()
+    try:
+      stack = run(self.program, self.blocks, state, input, self.read_func, output, self.no_prng, profile, resume)
+    except Stopped:
+      self.stopped = True
+      stack = None
+    except OutOfSteps:
+      self.error = 'OutOfSteps'
+      stack = None
+    except Exception as e:
+      self.error = error_name(e)
+      stack = None
+    if stack is None:
+      try:
+        output.flush()
+      except OSError:
+        pass  # the script's own error is the one to report
+    if watching:
+      unwatch_signals()
+    self.steps = state.steps
+    if profile is not None:
+      self.report = profile.report(self.name, self.program)
+    return stack
+
+
+def serve(fd_in, fd_out, scripts, read_func, no_prng):
+  """Answers the requests read from `fd_in` until end of file."""
+  requests = rreader(fd_in)
+  while True:
+    header = requests.read_line()
+    if header is None:
+      return
+    fields = header.split(' ')
+    key = '-'
+    length = -1
+    if len(fields) == 3 and (fields[0] == 'run' or fields[0] == 'cached'):
+      try:
+        length = string_to_int(fields[2])
+        if fields[0] == 'run':
+          size = string_to_int(fields[1])
+          source = requests.read(size)
+          if size < 0 or len(source) < size:
+            length = -1
+          else:
+            key = RSHA(source).hexdigest()
+            if key not in scripts:
+              if len(scripts) >= MAX_SCRIPTS:
+                scripts.clear()
+              scripts[key] = interpreter(key, source, read_func, no_prng)
+        else:
+          key = fields[1]
+      except ParseStringError:
+        length = -1
+    data = ''
+    if length >= 0:
+      data = requests.read(length)
+    if length < 0 or len(data) < length:
+      write_all(fd_out, '2 %s 0\n'%key)
+      return
+    if key not in scripts:
+      write_all(fd_out, '3 %s 0\n'%key)
+      continue
+    runner = scripts[key]
+    status = 0
+    if not runner.execute([], data):
+      status = 1
+    write_all(fd_out, '%d %s %d\n'%(status, key, len(runner.output)))
+    write_all(fd_out, runner.output)
+
+def listen(path, scripts, read_func, no_prng):
+  """Serves connections to a unix socket at `path` until stopped."""
+  remove_socket(path)
+  try:
+    sock = RSocket(AF_UNIX, SOCK_STREAM)
+    sock.bind(UNIXAddress(path))
+    sock.listen(16)
+  except SocketError:
+    os.write(2, 'Cannot listen on %s\n'%path)
+    return 1
+  if we_are_translated():
+    pypysig_ignore(SIGPIPE)
+    pypysig_setflag(SIGTERM)
+    pypysig_setflag(SIGINT)
+  status = 0
+  failures = 0
+  while not stop_requested():
+    try:
+      fd, _ = sock.accept()
+    except SocketError:
+      failures += 1
+      if failures >= MAX_ACCEPT_FAILURES:
+        os.write(2, 'Cannot accept connections on %s\n'%path)
+        status = 1
+        break
+      sleep(0.001 * (1 << failures))
+      continue
+    failures = 0
+    try:
+      serve(fd, fd, scripts, read_func, no_prng)
+    except (OSError, Interrupted):
+      pass
+    os.close(fd)
+  sock.close()
+  remove_socket(path)
+  return status
+
+def remove_socket(path):
+  try:
+    if stat.S_ISSOCK(os.stat(path).st_mode):
+      os.unlink(path)
+  except OSError:
+    pass
+
+
+class batch(object):
+  """Scripts run by --parallel, each forked with a copy of `stack`."""
+  __slots__ = ['names', 'sources', 'stack', 'read_func', 'no_prng', 'buffer_size', 'jit_stats', 'failed']
+
+  def __init__(self, stack, read_func, no_prng, buffer_size, jit_stats):
+    self.names = []
+    self.stack = stack
+    self.sources = []
+    self.read_func = read_func
+    self.no_prng = no_prng
+    self.buffer_size = buffer_size
+    self.jit_stats = jit_stats
+    self.failed = False
+
+  def add(self, name, source):
+    self.names.append(name)
+    self.sources.append(source)
+
+  def work(self, i):
+    """Runs the i-th script, in a process of its own."""
+    name = self.names[i]
+    source = self.sources[i]
+    if source is None:
+      try:
+        with open(name) as file:
+          source = file.read()
+      except IOError:
+        os.write(2, 'File not found: %s\n'%name)
+        return 1
+    reports = []
+    input = rreader(0, DEFAULT_BUFFER_SIZE, False)
+    output = rwriter(1, self.buffer_size)
+    stack = run_program(name, source, self.stack, input, self.read_func, output, self.no_prng, reports)
+    if reports:
+      write_reports(reports, '')
+    if self.jit_stats:
+      write_all(2, JIT_STATS.report())
+    if stack is None:
+      return 1
+    return 0
+
+  def write(self, i, out, err, status):
+    write_all(1, out)
+    write_all(2, err)
+    if status > 1:
+      os.write(2, '%s: exited with status %d\n'%(self.names[i], status))
+    if status != 0:
+      self.failed = True
 
 
 def main(argv):
   from rgetopt import gnu_getopt, GetoptError
   try:
-    optlist, args = gnu_getopt(argv[1:], 'hc:u', ['help', 'code=', 'utf8', 'no-prng'])
+    optlist, args = gnu_getopt(argv[1:], 'hc:uv:s:', ['help', 'code=', 'utf8', 'value=', 'string=', 'stack-file=', 'stack-format=', 'no-prng', 'unbuffered', 'buffer-size=', 'line-buffered', 'profile', 'profile-file=', 'jit=', 'jit-stats', 'serve', 'socket=', 'parallel=', 'numeric=', 'decimals=', 'checkpoint=', 'checkpoint-every=', 'resume=', 'trace=', 'seed=', 'record-input=', 'replay-input='])
   except GetoptError as ex:
     os.write(2, ex.msg + '\n')
     return 1
@@ -277,53 +808,274 @@ def main(argv):
   source = ''
   has_code = False
   read_func = read_char
+  utf8 = False
+  preload = []
+  stack_width = 0
   no_prng = False
+  record_file = ''
+  replay_file = ''
+  buffer_size = DEFAULT_BUFFER_SIZE
+  line_buffered = os.isatty(0)
+  profile_file = ''
+  jit_stats = False
+  serving = False
+  socket_path = ''
+  workers = 0
+  checkpoint_file = ''
+  checkpoint_every = 0
+  resume_file = ''
   for opt, val in optlist:
     if opt == '-c' or opt == '--code':
       source = val
       has_code = True
     elif opt == '-u' or opt == '--utf8':
       read_func = read_unichar
+      utf8 = True
+    elif opt == '-v' or opt == '--value' or opt == '-s' or opt == '--string' or opt == '--stack-file':
+      preload.append((opt, val))
+    elif opt == '--stack-format':
+      if val not in FORMATS:
+        os.write(2, 'Invalid stack format: %s\n'%val)
+        return 1
+      stack_width = FORMATS[val]
     elif opt == '--no-prng':
       no_prng = True
+    elif opt == '--seed':
+      try:
+        SETTINGS.seed = string_to_int(val)
+      except ParseStringError:
+        os.write(2, 'Invalid seed: %s\n'%val)
+        return 1
+      SETTINGS.seeded = True
+    elif opt == '--record-input':
+      record_file = val
+    elif opt == '--replay-input':
+      replay_file = val
+    elif opt == '--unbuffered':
+      buffer_size = 0
+    elif opt == '--line-buffered':
+      line_buffered = True
+    elif opt == '--profile':
+      SETTINGS.profiling = True
+    elif opt == '--profile-file':
+      SETTINGS.profiling = True
+      profile_file = val
+    elif opt == '--jit':
+      try:
+        jit.set_user_param(jitdriver, val)
+      except (ValueError, jit.TraceLimitTooHigh):
+        os.write(2, 'Invalid JIT parameters: %s\n'%val)
+        return 1
+    elif opt == '--jit-stats':
+      jit_stats = True
+    elif opt == '--serve':
+      serving = True
+    elif opt == '--socket':
+      serving = True
+      socket_path = val
+    elif opt == '--numeric':
+      if val not in NUMERICS:
+        os.write(2, 'Invalid numeric backend: %s\n'%val)
+        return 1
+      SETTINGS.numeric = NUMERICS[val]
+    elif opt == '--decimals':
+      try:
+        SETTINGS.decimals = string_to_int(val)
+      except ParseStringError:
+        SETTINGS.decimals = -1
+      if SETTINGS.decimals < 0:
+        os.write(2, 'Invalid number of decimals: %s\n'%val)
+        return 1
+    elif opt == '--checkpoint':
+      checkpoint_file = val
+    elif opt == '--checkpoint-every':
+      try:
+        checkpoint_every = string_to_int(val)
+      except ParseStringError:
+        checkpoint_every = 0
+      if checkpoint_every < 1:
+        os.write(2, 'Invalid checkpoint interval: %s\n'%val)
+        return 1
+    elif opt == '--resume':
+      resume_file = val
+    elif opt == '--trace':
+      try:
+        trace_size = string_to_int(val)
+      except ParseStringError:
+        trace_size = 0
+      if trace_size < 1:
+        os.write(2, 'Invalid trace size: %s\n'%val)
+        return 1
+      SETTINGS.tracing = True
+      TRACE.enable(trace_size)
+    elif opt == '--parallel':
+      try:
+        workers = string_to_int(val)
+      except ParseStringError:
+        workers = 0
+      if workers < 1:
+        os.write(2, 'Invalid number of workers: %s\n'%val)
+        return 1
+    elif opt == '--buffer-size':
+      try:
+        buffer_size = string_to_int(val)
+      except ParseStringError:
+        os.write(2, 'Invalid buffer size: %s\n'%val)
+        return 1
     elif opt == '-h' or opt == '--help':
       display_usage(argv[0])
       display_help()
       return 1
 
-  if not has_code and len(args) < 1:
+  if serving and (has_code or len(args) > 0):
+    os.write(2, 'Scripts are sent to the server, not given as arguments\n')
+    return 1
+  if not serving and not has_code and len(args) < 1 and not resume_file:
     display_usage(argv[0])
     return 1
+  if (serving or resume_file) and preload:
+    os.write(2, 'The initial stack cannot be set with --serve or --resume\n')
+    return 1
+  if (serving or workers > 0) and (checkpoint_file or checkpoint_every > 0 or resume_file):
+    os.write(2, 'Checkpoints are not supported with --serve or --parallel\n')
+    return 1
+  if (serving or workers > 0) and (record_file or replay_file):
+    os.write(2, 'Input cannot be recorded or replayed with --serve or --parallel\n')
+    return 1
+  if workers > 0 and profile_file:
+    os.write(2, 'Profiles of parallel scripts are written to stderr\n')
+    return 1
+
+  if jit_stats:
+    JIT_STATS.enable()
 
   stack = rdeque()
+  for opt, val in preload:
+    if not load_values(stack, opt, val, utf8, stack_width):
+      return 1
+
+  if serving:
+    scripts = {}
+    status = 0
+    if socket_path:
+      status = listen(socket_path, scripts, read_func, no_prng)
+    else:
+      serve(0, 1, scripts, read_func, no_prng)
+    if jit_stats:
+      write_all(2, JIT_STATS.report())
+    return status
+
+  if workers > 0:
+    jobs = batch(stack, read_func, no_prng, buffer_size, jit_stats)
+    if has_code:
+      jobs.add('-c', source)
+    for arg in args:
+      jobs.add(arg, None)
+    rpool(workers, len(jobs.names)).run(jobs)
+    if jobs.failed:
+      return 1
+    return 0
+
+  resume = None
+  if resume_file:
+    try:
+      resume = rsnapshot.load(read_snapshot(resume_file), NUMERICS)
+    except OSError:
+      os.write(2, 'File not found: %s\n'%resume_file)
+      return 1
+    except ValueError:
+      os.write(2, 'Invalid checkpoint: %s\n'%resume_file)
+      return 1
+    SETTINGS.numeric = resume.numeric
+  if checkpoint_file or checkpoint_every > 0:
+    if not checkpoint_file:
+      checkpoint_file = DEFAULT_CHECKPOINT
+    SETTINGS.checkpoint(checkpoint_file, checkpoint_every)
 
-  if has_code:
-    program, col_max, row_max = parse(source)
+  input = rreader(0, DEFAULT_BUFFER_SIZE, line_buffered)
+  output = rwriter(1, buffer_size)
+  if replay_file:
+    try:
+      input = rreader(os.open(replay_file, os.O_RDONLY, 0))
+    except OSError:
+      os.write(2, 'File not found: %s\n'%replay_file)
+      return 1
+  record = None
+  if record_file:
     try:
-      stack = run(program, col_max, row_max, stack, read_func, no_prng)
-    except:
-      os.write(2, 'something smells fishy...\n')
+      record = rwriter(os.open(record_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0644))
+    except OSError:
+      os.write(2, 'Cannot write input record: %s\n'%record_file)
       return 1
+    input.record = record
+
+  reports = []
+  if resume is not None:
+    stack = run_program(resume_file, '', stack, input, read_func, output, no_prng, reports, resume)
+  if has_code and stack is not None:
+    stack = run_program('-c', source, stack, input, read_func, output, no_prng, reports)
 
   for arg in args:
+    if stack is None:
+      break
     try:
       with open(arg) as file:
         source = file.read()
     except IOError:
       os.write(2, 'File not found: %s\n'%arg)
-      return 1
-    program, col_max, row_max = parse(source)
-    try:
-      stack = run(program, col_max, row_max, stack, read_func, no_prng)
-    except:
-      os.write(2, 'something smells fishy...\n')
-      return 1
+      stack = None
+      break
+    stack = run_program(arg, source, stack, input, read_func, output, no_prng, reports)
 
+  if record is not None:
+    record.flush()
+    os.close(record.fd)
+  if reports:
+    write_reports(reports, profile_file)
+  if jit_stats:
+    write_all(2, JIT_STATS.report())
+  if stack is None:
+    return 1
   return 0
 
 
+def load_values(stack, opt, val, utf8, width):
+  """Pushes the values of -v, -s or --stack-file, or returns False."""
+  numeric = SETTINGS.numeric
+  if opt == '-s' or opt == '--string':
+    if utf8:
+      for c in Utf8StringIterator(val):
+        stack.append(numeric.fromint(c))
+    else:
+      for c in val:
+        stack.append(numeric.fromint(ord(c)))
+  elif opt == '--stack-file':
+    try:
+      values = read_stack_file(val, width, numeric)
+    except OSError:
+      os.write(2, 'File not found: %s\n'%val)
+      return False
+    except ValueError:
+      os.write(2, 'Invalid stack file: %s\n'%val)
+      return False
+    if stack.len() == 0:
+      stack.take(values)
+    else:
+      stack.iadd(values)
+  else:
+    for word in val.split(' '):
+      if not word:
+        continue
+      try:
+        stack.append(numeric.fromstr(word))
+      except ValueError:
+        os.write(2, 'Invalid value: %s\n'%word)
+        return False
+  return True
+
+
 def display_usage(name):
-  os.write(2, 'Usage: %s [-h] (-c <code> | <files...>) [<options>]\n'%name)
+  os.write(2, 'Usage: %s [-h] (-c <code> | <files...> | --serve) [<options>]\n'%name)
 
 def display_help():
   os.write(2, '''
@@ -331,16 +1083,80 @@ A just-in-time compiling interpreter for the ><> programming language.
 
 Arguments:
   files...        ><> script files to be executed, in order
-                  the current stack will be passed to the next script
+                  the current stack will be passed to the next script,
+                  unless run with --parallel
 
 Options:
   -c, --code=     a string of instructions to be executed
                   if present, will be executed before files
   -u, --utf8      parse input as utf-8
+  -v, --value=    numbers to push onto the initial stack, separated by
+                  spaces, such as integers or decimals
+  -s, --string=   a string whose characters are pushed onto the initial
+                  stack, as utf-8 with --utf8
+      --stack-file=
+                  push the numbers in a file onto the initial stack, read
+                  by mapping it into memory
+      --stack-format=
+                  the format of stack files, one of
+                    text   numbers separated by whitespace (default)
+                    int32  signed 32-bit little-endian integers
+                    int64  signed 64-bit little-endian integers
       --no-prng   disable the PRNG (`x` command becomes a no-op)
+      --seed=     seed the PRNG, so that `x` makes the same choices on every
+                  run (default: seeded from the clock)
+      --record-input=
+                  save the bytes of input read by `i` to a file
+      --replay-input=
+                  read input from a file saved by --record-input, rather
+                  than from stdin
+      --numeric=  the type of the values on the stack, one of
+                    rational  exact, with arbitrary precision (default)
+                    int       integers of any size, `,` rounds down
+                    float     doubles, as the reference interpreter
+      --decimals=N
+                  write rationals exactly, to at most N decimal places,
+                  rather than as the nearest float
+      --unbuffered
+                  write output immediately, rather than buffering it
+      --buffer-size=
+                  size of the output buffer in bytes (default 65536)
+      --line-buffered
+                  read input one line at a time (default if stdin is a tty)
+      --profile   count the instructions executed at each cell and of each
+                  opcode, and report them on stderr at exit
+      --profile-file=
+                  as --profile, but write the report to a file
+      --jit=      comma separated JIT parameters, as name=value, such as
+                    threshold           loop iterations before tracing
+                    function_threshold  runs of a function before tracing
+                    trace_limit         operations before a trace aborts
+                    loop_longevity      how long unused loops are kept
+                  or `off` to disable the JIT
+      --jit-stats
+                  report traces compiled and aborted on stderr at exit
+      --trace=N   record the last N steps, and if a script fails, report
+                  them with its stack on stderr
+      --serve     answer requests to run scripts, read from stdin, keeping
+                  scripts and compiled traces between them (see README)
+      --socket=   as --serve, but accept connections on a unix socket
+      --checkpoint=
+                  write snapshots of the running script to a file, on
+                  SIGUSR1, and on SIGTERM before exiting
+                  (default fish.checkpoint, with --checkpoint-every)
+      --checkpoint-every=STEPS
+                  also write a snapshot about every STEPS steps
+      --resume=   continue from a snapshot, before any other scripts
+      --parallel=N
+                  run each script on the initial stack with no input, in up to
+                  N processes at once, writing their output in order
   -h, --help      display this message
 ''')
 
 
 def target(*args):
   return main
+
+def jitpolicy(driver):
+  from rpython.jit.codewriter.policy import JitPolicy
+  return JitPolicy(JIT_HOOKS)
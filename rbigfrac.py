@@ -1,156 +1,402 @@
 import math
 
 from rpython.rlib import jit
-from rpython.rlib.rbigint import rbigint, ONERBIGINT, NULLRBIGINT, _AsScaledDouble, SHIFT
+from rpython.rlib.rarithmetic import ovfcheck
+from rpython.rlib.rbigint import rbigint, ONERBIGINT, _AsScaledDouble, SHIFT
 from rpython.rlib.rfloat import float_as_rbigint_ratio, formatd
 
-class rbigfrac(object):
-  __slots__ = ['numerator', 'denominator']
+from rdecimal import parse_decimal, write_fraction
+from rnumber import rnumber, rnumeric
 
-  def __init__(self, numerator, denominator):
+LEHMER_BITS = 31
+LAZY_DIGITS = 2
+
+def gcd(a, b):
+  """The gcd of two rbigints, by Lehmer's algorithm."""
+  a, b = a.abs(), b.abs()
+  if a.lt(b):
+    a, b = b, a
+  while b.numdigits() > 1:
+    a, b = lehmer(a, b)
+  if not b.tobool():
+    return a
+  x, y = b.toint(), a.int_mod(b.toint()).toint()
+  while y:
+    x, y = y, x % y
+  return rbigint.fromint(x)
+
+def lehmer(a, b):
+  """One round of Lehmer's algorithm, for a >= b > 0."""
+  shift = a.bit_length() - LEHMER_BITS
+  x = a.rshift(shift).toint()
+  y = b.rshift(shift).toint()
+  A, B, C, D = 1, 0, 0, 1
+  while y + C != 0 and y + D != 0:
+    q = (x + A) // (y + C)
+    if q != (x + B) // (y + D):
+      break
+    A, C = C, A - q * C
+    B, D = D, B - q * D
+    x, y = y, x - q * y
+  if B == 0:
+    return b, a.mod(b)
+  return a.int_mul(A).add(b.int_mul(B)), a.int_mul(C).add(b.int_mul(D))
+
+
+class rbigfrac(rnumber):
+  """An exact rational, or a machine word in `intval`."""
+  __slots__ = ['numerator', 'denominator', 'intval', 'lowest']
+
+  def __init__(self, numerator, denominator, intval = 0, lowest = True):
     self.numerator = numerator
     self.denominator = denominator
+    self.intval = intval
+    self.lowest = lowest
 
-  def normalize(self):
-    if self.denominator.int_ne(1):
-      g = self.numerator.gcd(self.denominator)
-      self.numerator = self.numerator.div(g)
-      self.denominator = self.denominator.div(g)
+  def is_int(self):
+    return self.numerator is None
+
+  def shrink(self):
+    if self.lowest and self.numerator is not None and self.denominator.int_eq(1) and self.numerator.numdigits() == 1:
+      self.intval = self.numerator.toint()
+      self.numerator = None
+      self.denominator = None
 
   @property
   def n(self):
+    if self.numerator is None:
+      return rbigint.fromint(self.intval)
     return self.numerator
 
   @property
   def d(self):
+    if self.denominator is None:
+      return ONERBIGINT
     return self.denominator
 
   @staticmethod
-  @jit.elidable
   def fromint(n):
-    return rbigfrac(rbigint.fromint(n), ONERBIGINT)
+    return rbigfrac(None, None, n)
+
+  @staticmethod
+  def frombig(numerator, denominator):
+    ret = rbigfrac(numerator, denominator)
+    ret.shrink()
+    return ret
+
+  @staticmethod
+  def reduced(numerator, denominator):
+    """Divides out the gcd of any numerator and positive denominator."""
+    if numerator.get_sign() == 0:
+      return ZERO
+    g = gcd(numerator, denominator)
+    if g.int_ne(1):
+      numerator = numerator.floordiv(g)
+      denominator = denominator.floordiv(g)
+    return rbigfrac.frombig(numerator, denominator)
+
+  @staticmethod
+  def lazy(numerator, denominator):
+    """numerator / denominator, reduced once either part is large."""
+    if numerator.numdigits() > LAZY_DIGITS or denominator.numdigits() > LAZY_DIGITS:
+      return rbigfrac.reduced(numerator, denominator)
+    if numerator.get_sign() == 0:
+      return ZERO
+    if denominator.int_eq(1):
+      return rbigfrac.frombig(numerator, ONERBIGINT)
+    return rbigfrac(numerator, denominator, 0, False)
+
+  def small(self):
+    """Whether neither part has more than LAZY_DIGITS digits."""
+    return (self.numerator is None or
+            (self.numerator.numdigits() <= LAZY_DIGITS and self.denominator.numdigits() <= LAZY_DIGITS))
+
+  def normalized(self):
+    """The value in lowest terms."""
+    if self.lowest:
+      return self
+    return rbigfrac.reduced(self.numerator, self.denominator)
+
+  @staticmethod
+  def sum(a, b, c, d):
+    """a/b + c/d, for ratios in lowest terms."""
+    if b.int_eq(1) and d.int_eq(1):
+      return rbigfrac.frombig(a.add(c), ONERBIGINT)
+    g = gcd(b, d)
+    if g.int_eq(1):
+      return rbigfrac.frombig(a.mul(d).add(c.mul(b)), b.mul(d))
+    b = b.floordiv(g)
+    num = a.mul(d.floordiv(g)).add(c.mul(b))
+    if num.get_sign() == 0:
+      return ZERO
+    h = gcd(num, g)
+    if h.int_ne(1):
+      num = num.floordiv(h)
+      d = d.floordiv(h)
+    return rbigfrac.frombig(num, b.mul(d))
+
+  @staticmethod
+  def product(a, b, c, d):
+    """a/b * c/d, for ratios in lowest terms."""
+    g = gcd(a, d)
+    if g.int_ne(1):
+      a = a.floordiv(g)
+      d = d.floordiv(g)
+    g = gcd(c, b)
+    if g.int_ne(1):
+      c = c.floordiv(g)
+      b = b.floordiv(g)
+    return rbigfrac.frombig(a.mul(c), b.mul(d))
 
   @staticmethod
   @jit.elidable
   def fromfloat(f):
     num, den = float_as_rbigint_ratio(f)
-    return rbigfrac(num, den)
+    return rbigfrac.frombig(num, den)
 
   @staticmethod
-  @jit.elidable
   def frombool(b):
     if b: return ONE
     return ZERO
 
-  @jit.elidable
   def toint(self):
+    if self.numerator is None:
+      return self.intval
+    return self._toint()
+
+  @jit.elidable
+  def _toint(self):
     return self.n.div(self.d).toint()
 
   @jit.elidable
   def tofloat(self):
+    if self.numerator is None:
+      return float(self.intval)
     nman, nexp = _AsScaledDouble(self.n)
     dman, dexp = _AsScaledDouble(self.d)
     return math.ldexp(nman / dman, (nexp - dexp) * SHIFT)
 
-  @jit.elidable
   def tobool(self):
-    return self.n.tobool()
+    if self.numerator is None:
+      return self.intval != 0
+    return self.numerator.tobool()
+
+  def numeric(self):
+    return RATIONALS
+
+  def isword(self):
+    return self.numerator is None
+
+  def tobig(self):
+    if self.numerator is None:
+      return rbigint.fromint(self.intval)
+    if not self.lowest:
+      return self.normalized().tobig()
+    if self.denominator.int_eq(1):
+      return self.numerator
+    return None
 
   @jit.elidable
   def tostr(self):
-    self.normalize()
+    if not self.lowest:
+      return self.normalized().tostr()
+    if self.numerator is None:
+      return str(self.intval)
     if self.d.int_eq(1):
       return self.n.str()
     # undesirable!
     return formatd(self.tofloat(), 'r', 0)
 
-  @jit.elidable
+  def dump(self, out):
+    if self.numerator is None:
+      out.int(0)
+      out.int(self.intval)
+    else:
+      out.int(1)
+      out.big(self.numerator)
+      out.big(self.denominator)
+
+  def write(self, output, places):
+    if not self.lowest:
+      self.normalized().write(output, places)
+    elif self.numerator is not None and not self.denominator.int_eq(1) and places >= 0:
+      write_fraction(output, self.numerator, self.denominator, places)
+    else:
+      output.write(self.tostr())
+
   def add(self, other):
-    ret = rbigfrac(
-      self.n.mul(other.d).add(self.d.mul(other.n)),
-      self.d.mul(other.d)
-    )
-    if self.d.numdigits() > 1 and other.d.numdigits() > 1:
-      ret.normalize()
-    return ret
+    assert isinstance(other, rbigfrac)
+    if self.numerator is None and other.numerator is None:
+      try:
+        return rbigfrac.fromint(ovfcheck(self.intval + other.intval))
+      except OverflowError:
+        pass
+    return self._add(other)
 
   @jit.elidable
+  def _add(self, other):
+    if self.small() and other.small():
+      return rbigfrac.lazy(self.n.mul(other.d).add(other.n.mul(self.d)), self.d.mul(other.d))
+    x, y = self.normalized(), other.normalized()
+    return rbigfrac.sum(x.n, x.d, y.n, y.d)
+
   def sub(self, other):
-    ret = rbigfrac(
-      self.n.mul(other.d).sub(self.d.mul(other.n)),
-      self.d.mul(other.d)
-    )
-    if self.d.numdigits() > 1 and other.d.numdigits() > 1:
-      ret.normalize()
-    return ret
+    assert isinstance(other, rbigfrac)
+    if self.numerator is None and other.numerator is None:
+      try:
+        return rbigfrac.fromint(ovfcheck(self.intval - other.intval))
+      except OverflowError:
+        pass
+    return self._sub(other)
 
   @jit.elidable
+  def _sub(self, other):
+    if self.small() and other.small():
+      return rbigfrac.lazy(self.n.mul(other.d).sub(other.n.mul(self.d)), self.d.mul(other.d))
+    x, y = self.normalized(), other.normalized()
+    return rbigfrac.sum(x.n, x.d, y.n.neg(), y.d)
+
   def mul(self, other):
-    ret = rbigfrac(
-      self.n.mul(other.n),
-      self.d.mul(other.d)
-    )
-    if self.d.numdigits() > 1 and other.d.numdigits() > 1:
-      ret.normalize()
-    return ret
+    assert isinstance(other, rbigfrac)
+    if self.numerator is None and other.numerator is None:
+      try:
+        return rbigfrac.fromint(ovfcheck(self.intval * other.intval))
+      except OverflowError:
+        pass
+    return self._mul(other)
 
   @jit.elidable
+  def _mul(self, other):
+    if self.small() and other.small():
+      return rbigfrac.lazy(self.n.mul(other.n), self.d.mul(other.d))
+    x, y = self.normalized(), other.normalized()
+    return rbigfrac.product(x.n, x.d, y.n, y.d)
+
   def div(self, other):
-    if other.n.get_sign() == 0: raise ZeroDivisionError
-    num = self.n.mul(other.d)
-    den = self.d.mul(other.n)
-    if den.get_sign() == -1:
-      num = num.neg()
-      den = den.neg()
-    ret = rbigfrac(num, den)
-    if self.d.numdigits() > 1 and other.n.numdigits() > 1:
-      ret.normalize()
-    return ret
+    assert isinstance(other, rbigfrac)
+    if self.numerator is None and other.numerator is None:
+      a, b = self.intval, other.intval
+      if b == 0: raise ZeroDivisionError
+      if b != -1 and a % b == 0:
+        return rbigfrac.fromint(a // b)
+    return self._div(other)
 
   @jit.elidable
+  def _div(self, other):
+    if other.n.get_sign() == 0: raise ZeroDivisionError
+    c, d = other.d, other.n
+    if d.get_sign() < 0:
+      c, d = c.neg(), d.neg()
+    if self.small() and other.small():
+      return rbigfrac.lazy(self.n.mul(c), self.d.mul(d))
+    x = self.normalized()
+    if not other.lowest:
+      g = gcd(c, d)
+      c, d = c.floordiv(g), d.floordiv(g)
+    return rbigfrac.product(x.n, x.d, c, d)
+
   def floordiv(self, other):
-    return rbigfrac(
+    assert isinstance(other, rbigfrac)
+    if self.numerator is None and other.numerator is None:
+      a, b = self.intval, other.intval
+      if b == 0: raise ZeroDivisionError
+      if b != -1:
+        return rbigfrac.fromint(a // b)
+    return self._floordiv(other)
+
+  @jit.elidable
+  def _floordiv(self, other):
+    return rbigfrac.frombig(
       self.n.mul(other.d).div(self.d.mul(other.n)),
       ONERBIGINT
     )
 
-  @jit.elidable
   def mod(self, other):
-    num = self.n.mul(other.d)
-    den = self.d.mul(other.n)
-    quo = num.div(den)
-    ret = rbigfrac(
-      num.sub(den.mul(quo)),
-      self.d.mul(other.d)
-    )
-    if self.d.numdigits() > 1 and other.d.numdigits() > 1:
-      ret.normalize()
-    return ret
+    assert isinstance(other, rbigfrac)
+    if self.numerator is None and other.numerator is None:
+      a, b = self.intval, other.intval
+      if b == 0: raise ZeroDivisionError
+      if b == -1: return ZERO
+      return rbigfrac.fromint(a % b)
+    return self._mod(other)
 
   @jit.elidable
+  def _mod(self, other):
+    if other.n.get_sign() == 0: raise ZeroDivisionError
+    a, b, c, d = self.n, self.d, other.n, other.d
+    g = gcd(b, d)
+    if g.int_ne(1):
+      b = b.floordiv(g)
+      d = d.floordiv(g)
+    num = a.mul(d).mod(c.mul(b))
+    return rbigfrac.reduced(num, b.mul(d).mul(g))
+
   def lt(self, other):
-    return self.n.mul(other.d).lt(self.d.mul(other.n))
+    assert isinstance(other, rbigfrac)
+    if self.numerator is None and other.numerator is None:
+      return self.intval < other.intval
+    return self._lt(other)
 
   @jit.elidable
+  def _lt(self, other):
+    a, c = self.n.get_sign(), other.n.get_sign()
+    if a != c:
+      return a < c
+    if self.d.eq(other.d):
+      return self.n.lt(other.n)
+    return self.n.mul(other.d).lt(self.d.mul(other.n))
+
   def le(self, other):
     return not other.lt(self)
 
-  @jit.elidable
   def gt(self, other):
     return other.lt(self)
 
-  @jit.elidable
   def ge(self, other):
     return not self.lt(other)
 
-  @jit.elidable
   def eq(self, other):
-    return self.n.mul(other.d).eq(self.d.mul(other.n))
+    assert isinstance(other, rbigfrac)
+    if self.numerator is None and other.numerator is None:
+      return self.intval == other.intval
+    return self._eq(other)
 
   @jit.elidable
+  def _eq(self, other):
+    if self.lowest and other.lowest:
+      return self.n.eq(other.n) and self.d.eq(other.d)
+    return self.n.mul(other.d).eq(self.d.mul(other.n))
+
   def ne(self, other):
     return not self.eq(other)
 
 
-ZERO = rbigfrac(NULLRBIGINT, ONERBIGINT)
-ONE  = rbigfrac( ONERBIGINT, ONERBIGINT)
+ZERO = rbigfrac.fromint(0)
+ONE  = rbigfrac.fromint(1)
+
+
+class rationals(rnumeric):
+  def fromint(self, n):
+    return rbigfrac.fromint(n)
+
+  def frombool(self, b):
+    return rbigfrac.frombool(b)
+
+  def frombig(self, big):
+    return rbigfrac.frombig(big, ONERBIGINT)
+
+  def fromstr(self, s):
+    numerator, places = parse_decimal(s)
+    if places == 0:
+      return rbigfrac.frombig(numerator, ONERBIGINT)
+    return rbigfrac.reduced(numerator, rbigint.fromint(10).pow(rbigint.fromint(places)))
+
+  def load(self, inp):
+    if inp.int() == 0:
+      return rbigfrac.fromint(inp.int())
+    numerator, denominator = inp.big(), inp.big()
+    if denominator.get_sign() <= 0:
+      raise ValueError('corrupt snapshot')
+    return rbigfrac.reduced(numerator, denominator)
+
+RATIONALS = rationals('rational')
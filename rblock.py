@@ -0,0 +1,82 @@
+K_PUSH, K_DYADIC, K_DYADIC_CONST, K_STACK, K_EXEC, K_EXTEND = range(6)
+
+
+class rblock(object):
+  """A straight-line run of instructions, as parallel op arrays."""
+  _immutable_fields_ = ['kinds[*]', 'codes[*]', 'values[*]', 'strings[*]', 'steps[*]', 'xs[*]', 'ys[*]', 'last_x', 'last_y', 'cells']
+
+  def __init__(self, kinds, codes, values, strings, steps, xs, ys, last_x, last_y, cells):
+    self.kinds = kinds
+    self.codes = codes
+    self.values = values
+    self.strings = strings
+    self.steps = steps
+    self.xs = xs
+    self.ys = ys
+    self.last_x = last_x
+    self.last_y = last_y
+    self.cells = cells
+
+  def len(self):
+    return len(self.kinds)
+
+
+NO_BLOCK = rblock([], [], [], [], [], [], [], 0, 0, 0)
+
+
+class rblockcache(object):
+  """Compiled blocks per entry cell and direction of a codebox."""
+  __slots__ = ['width', 'height', 'right', 'left', 'down', 'up']
+
+  def __init__(self, width, height):
+    self.width = width
+    self.height = height
+    self.right = [[]] * height
+    self.left = [[]] * height
+    self.down = [[]] * width
+    self.up = [[]] * width
+
+  def get(self, x, y, dx, dy):
+    if 0 <= y < self.height and 0 <= x < self.width:
+      if dy == 0:
+        if dx > 0:
+          row = self.right[y]
+        else:
+          row = self.left[y]
+        if x < len(row):
+          return row[x]
+        return None
+      if dy > 0:
+        col = self.down[x]
+      else:
+        col = self.up[x]
+      if y < len(col):
+        return col[y]
+      return None
+    return NO_BLOCK
+
+  def set(self, x, y, dx, dy, block):
+    if dy == 0:
+      if dx > 0:
+        rows = self.right
+      else:
+        rows = self.left
+      if not rows[y]:
+        rows[y] = [None] * self.width
+      rows[y][x] = block
+    else:
+      if dy > 0:
+        cols = self.down
+      else:
+        cols = self.up
+      if not cols[x]:
+        cols[x] = [None] * self.height
+      cols[x][y] = block
+
+  def invalidate(self, x, y):
+    if 0 <= y < self.height:
+      self.right[y] = []
+      self.left[y] = []
+    if 0 <= x < self.width:
+      self.down[x] = []
+      self.up[x] = []
@@ -0,0 +1,88 @@
+from rpython.rlib.rbigint import rbigint
+
+
+class rpowers(object):
+  """10 ** (2 ** k) for each k computed so far, shared by every fraction."""
+  __slots__ = ['powers']
+
+  def __init__(self):
+    self.powers = [rbigint.fromint(10)]
+
+  def get(self, k):
+    while len(self.powers) <= k:
+      last = self.powers[len(self.powers) - 1]
+      self.powers.append(last.mul(last))
+    return self.powers[k]
+
+POWERS = rpowers()
+
+
+def bits(n):
+  b = 0
+  while n:
+    n >>= 1
+    b += 1
+  return b
+
+
+def write_digits(output, n, width):
+  """Writes `n` zero padded to `width` digits."""
+  s = n.str()
+  if len(s) < width:
+    output.write('0' * (width - len(s)))
+  output.write(s)
+
+def strip_zeros(n, places):
+  """Removes the trailing zeros of `n`, returning it and its places."""
+  k = bits(places)
+  while k >= 0:
+    if places >= 1 << k:
+      high, low = n.divmod(POWERS.get(k))
+      if low.get_sign() == 0:
+        n = high
+        places -= 1 << k
+        continue
+    k -= 1
+  return n, places
+
+def write_fraction(output, numerator, denominator, places):
+  """Writes numerator / denominator, truncated to `places` digits."""
+  negative = numerator.get_sign() < 0
+  whole, rest = numerator.abs().divmod(denominator)
+  frac = rest
+  if places > 0 and rest.get_sign() != 0:
+    scale = rbigint.fromint(10).pow(rbigint.fromint(places))
+    frac, _ = rest.mul(scale).divmod(denominator)
+    frac, places = strip_zeros(frac, places)
+  else:
+    places = 0
+  if negative and (places > 0 or whole.get_sign() != 0):
+    output.write('-')
+  write_digits(output, whole, 0)
+  if places > 0:
+    output.write('.')
+    write_digits(output, frac, places)
+
+def parse_decimal(s):
+  """Parses a decimal as an rbigint scaled by 10 ** places, and places."""
+  digits = []
+  places = -1
+  start = 0
+  if s and (s[0] == '-' or s[0] == '+'):
+    start = 1
+  for i in range(start, len(s)):
+    c = s[i]
+    if c == '.' and places < 0:
+      places = 0
+    elif '0' <= c <= '9':
+      digits.append(c)
+      if places >= 0:
+        places += 1
+    else:
+      raise ValueError('invalid decimal')
+  if not digits:
+    raise ValueError('invalid decimal')
+  n = rbigint.fromstr(''.join(digits))
+  if s[0] == '-':
+    n = n.neg()
+  return n, max(places, 0)
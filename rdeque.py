@@ -1,78 +1,323 @@
+from rpython.rlib import jit
+
+from rstorage import EMPTY
+
+MIN_CAPACITY = 8
+
+
+def capacity_for(n):
+  """The smallest capacity which holds n items."""
+  capacity = MIN_CAPACITY
+  while capacity < n:
+    capacity <<= 1
+  return capacity
+
+
 class rdeque(object):
-  __slots__ = ['right', 'left']
+  """A ring buffer whose frames share its storage."""
+  __slots__ = ['strategy', 'storage', 'capacity', 'head', 'size', 'flipped', 'base', 'bases', 'parent']
 
   def __init__(self, right = []):
-    self.right = right[:]
-    self.left = []
+    self.init(right)
+    self.bases = []
+    self.parent = None
+
+  @staticmethod
+  def fromstorage(strategy, storage, size):
+    """A deque of the first `size` slots of `storage`."""
+    deque = rdeque()
+    deque.strategy = strategy
+    deque.storage = storage
+    deque.capacity = capacity_for(size)
+    deque.size = size
+    return deque
+
+  def init(self, right):
+    capacity = capacity_for(len(right))
+    strategy = EMPTY
+    for value in right:
+      if not strategy.fits(value):
+        strategy = strategy.generalized(value)
+    self.strategy = strategy
+    self.storage = strategy.allocate(capacity)
+    self.capacity = capacity
+    for i in range(len(right)):
+      strategy.setitem(self.storage, i, right[i])
+    self.head = 0
+    self.size = len(right)
+    self.flipped = False
+    self.base = 0
 
   def len(self):
-    return len(self.left) + len(self.right)
+    return self.size - self.base
+
+  def grow(self):
+    capacity = self.capacity
+    self.storage = self.strategy.copy(self.storage, self.head, self.size, capacity - 1, capacity << 1)
+    self.capacity = capacity << 1
+    self.head = 0
+
+  def fit(self, value):
+    """Switches to a strategy which also holds `value`."""
+    strategy = jit.promote(self.strategy)
+    if strategy.fits(value):
+      return
+    if self.size == 0:
+      strategy = EMPTY
+    self.switch(strategy.generalized(value))
+
+  def switch(self, strategy):
+    self.storage = strategy.convert(self.strategy, self.storage, self.head, self.size, self.capacity - 1)
+    self.strategy = strategy
+
+  def index(self, i):
+    """Physical index of the i-th item from the bottom of the frame."""
+    i += self.base
+    if self.flipped:
+      i = self.size - 1 - i
+    return (self.head + i) & (self.capacity - 1)
+
+  def get(self, i):
+    return jit.promote(self.strategy).getitem(self.storage, self.index(i))
+
+  def at(self, i):
+    """The i-th item from the bottom of the storage, in any frame."""
+    if self.flipped:
+      i = self.size - 1 - i
+    return self.strategy.getitem(self.storage, (self.head + i) & (self.capacity - 1))
+
+  def set(self, i, value):
+    self.fit(value)
+    self.strategy.setitem(self.storage, self.index(i), value)
+
+  def push_back(self, value):
+    self.fit(value)
+    if self.size == self.capacity:
+      self.grow()
+    self.strategy.setitem(self.storage, (self.head + self.size) & (self.capacity - 1), value)
+    self.size += 1
+
+  def push_front(self, value):
+    self.fit(value)
+    if self.size == self.capacity:
+      self.grow()
+    self.head = (self.head - 1) & (self.capacity - 1)
+    self.strategy.setitem(self.storage, self.head, value)
+    self.size += 1
+
+  def pop_back(self):
+    if self.size == 0:
+      raise IndexError('pop from empty list')
+    strategy = jit.promote(self.strategy)
+    self.size -= 1
+    i = (self.head + self.size) & (self.capacity - 1)
+    value = strategy.getitem(self.storage, i)
+    strategy.clearitem(self.storage, i)
+    return value
+
+  def pop_front(self):
+    if self.size == 0:
+      raise IndexError('pop from empty list')
+    strategy = jit.promote(self.strategy)
+    value = strategy.getitem(self.storage, self.head)
+    strategy.clearitem(self.storage, self.head)
+    self.head = (self.head + 1) & (self.capacity - 1)
+    self.size -= 1
+    return value
+
+  def drop(self, n):
+    """Discards the top n items."""
+    strategy = jit.promote(self.strategy)
+    mask = self.capacity - 1
+    if self.flipped:
+      for i in range(n):
+        strategy.clearitem(self.storage, (self.head + i) & mask)
+      self.head = (self.head + n) & mask
+    else:
+      for i in range(self.size - n, self.size):
+        strategy.clearitem(self.storage, (self.head + i) & mask)
+    self.size -= n
+
+  def open_frame(self, n):
+    """Makes the top n items a frame of their own."""
+    if n < 0 or n > self.len():
+      raise IndexError('list index out of range')
+    self.bases.append(self.base)
+    self.base = self.size - n
+
+  def close_frame(self):
+    """Closes the current frame, or returns False if there is none."""
+    if self.bases:
+      self.base = self.bases.pop()
+      return True
+    outer = self.parent
+    if outer is None:
+      return False
+    outer.iadd(self)
+    self.take(outer)
+    return True
+
+  def detach(self):
+    """Moves the current frame into storage of its own."""
+    if self.base == 0:
+      return
+    n = self.len()
+    outer = rdeque()
+    outer.take(self)
+    outer.base = outer.bases.pop()
+    self.init(outer.popn(n))
+    self.bases = []
+    self.parent = outer
+
+  def drop_frames(self):
+    """Discards all enclosing frames, keeping only the current one."""
+    self.detach()
+    self.bases = []
+    self.parent = None
+
+  def frames(self):
+    """Returns the items of every frame, the outermost first."""
+    if self.parent is None:
+      frames = []
+    else:
+      frames = self.parent.frames()
+    starts = self.bases + [self.base]
+    for j in range(len(starts)):
+      end = self.size
+      if j + 1 < len(starts):
+        end = starts[j + 1]
+      frames.append([self.at(i) for i in range(starts[j], end)])
+    return frames
+
+  @staticmethod
+  def fromframes(frames):
+    """Builds a stack with the frames returned by `frames`."""
+    stack = rdeque()
+    for j in range(len(frames)):
+      if j > 0:
+        stack.open_frame(0)
+      stack.extend(frames[j])
+    return stack
+
+  def take(self, other):
+    self.strategy = other.strategy
+    self.storage = other.storage
+    self.capacity = other.capacity
+    self.head = other.head
+    self.size = other.size
+    self.flipped = other.flipped
+    self.base = other.base
+    self.bases = other.bases
+    self.parent = other.parent
 
   def iadd(self, other):
-    tmp = other.left[:]
-    tmp.reverse()
-    self.right += tmp
-    self.right += other.right
+    """Appends the items of the current frame of `other`."""
+    n = other.len()
+    if self.size == 0 and other.strategy is not self.strategy:
+      self.switch(other.strategy)
+    if other.strategy is not self.strategy:
+      for i in range(n):
+        self.append(other.get(i))
+      return
+    while self.size + n > self.capacity:
+      self.grow()
+    strategy = self.strategy
+    mask = self.capacity - 1
+    if self.flipped:
+      for i in range(n):
+        self.head = (self.head - 1) & mask
+        strategy.moveitem(other.storage, other.index(i), self.storage, self.head)
+    else:
+      for i in range(n):
+        strategy.moveitem(other.storage, other.index(i), self.storage, (self.head + self.size + i) & mask)
+    self.size += n
 
   def append(self, value):
-    self.right.append(value)
+    if self.flipped:
+      self.push_front(value)
+    else:
+      self.push_back(value)
 
   def appendleft(self, value):
-    self.left.append(value)
+    self.detach()
+    if self.flipped:
+      self.push_back(value)
+    else:
+      self.push_front(value)
 
   def extend(self, values):
-    self.right += values
+    for value in values:
+      self.append(value)
 
   def extendleft(self, values):
-    tmp = values[:]
-    tmp.reverse()
-    self.left += tmp
+    for i in range(len(values) - 1, -1, -1):
+      self.appendleft(values[i])
 
   def pop(self):
-    if not self.right:
-      mid = len(self.left) + 1 >> 1
-      self.right = self.left[:mid]
-      self.right.reverse()
-      del self.left[:mid]
-    if self.right:
-      return self.right.pop()
-    raise IndexError('pop from empty list')
+    if self.size == self.base:
+      raise IndexError('pop from empty list')
+    if self.flipped:
+      return self.pop_front()
+    return self.pop_back()
 
   def popleft(self):
-    if not self.left:
-      mid = len(self.right) + 1 >> 1
-      self.left = self.right[:mid]
-      self.left.reverse()
-      del self.right[:mid]
-    if self.left:
-      return self.left.pop()
-    raise IndexError('pop from empty list')
+    if self.size == self.base:
+      raise IndexError('pop from empty list')
+    self.detach()
+    if self.flipped:
+      return self.pop_back()
+    return self.pop_front()
 
   def popn(self, n):
-    if n < 0:
+    if n < 0 or n > self.len():
       raise IndexError('list index out of range')
-    i = len(self.right) - n
-    if i >= 0:
-      result = self.right[i:]
-      del self.right[i:]
-      return result
-    i = -i
-    if len(self.left) >= i > 0:
-      result = self.left[:i]
-      result.reverse()
-      result += self.right
-      del self.left[:i]
-      self.right = []
-      return result
-    raise IndexError('list index out of range')
+    start = self.len() - n
+    result = [self.get(start + i) for i in range(n)]
+    self.drop(n)
+    return result
 
   def reverse(self):
-    self.left, self.right = self.right, self.left
+    self.detach()
+    self.flipped = not self.flipped
 
   def top(self):
-    i = len(self.right) - 1
-    if i >= 0:
-      return self.right[i]
-    if self.left:
-      return self.left[0]
-    raise IndexError('list index out of range')
+    if self.len() == 0:
+      raise IndexError('list index out of range')
+    return self.get(self.len() - 1)
+
+  def dup(self):
+    self.append(self.top())
+
+  def swap(self):
+    if self.len() < 2:
+      raise IndexError('list index out of range')
+    n = self.len()
+    a, b = self.get(n - 2), self.get(n - 1)
+    self.set(n - 2, b)
+    self.set(n - 1, a)
+
+  def rot3(self):
+    """Moves the top item beneath the two below it."""
+    if self.len() < 3:
+      raise IndexError('list index out of range')
+    n = self.len()
+    a, b, c = self.get(n - 3), self.get(n - 2), self.get(n - 1)
+    self.set(n - 3, c)
+    self.set(n - 2, a)
+    self.set(n - 1, b)
+
+  def roll(self, n):
+    """Rotates the whole stack by n, top to bottom."""
+    if self.len() < 2:
+      return
+    self.detach()
+    k = n % self.len()
+    if k > 0:
+      self.extendleft(self.popn(k))
+
+
+if __name__ == '__main__':
+  from rbigfrac import RATIONALS
+  from rinteger import INTEGERS
+  for numeric in [RATIONALS, INTEGERS]:
+    assert rdeque([numeric.fromint(i) for i in range(1, 4)]).strategy is numeric.words
@@ -0,0 +1,102 @@
+import math
+
+from rpython.rlib import jit
+from rpython.rlib.longlong2float import float2longlong, longlong2float
+from rpython.rlib.rarithmetic import intmask, ovfcheck_float_to_int, r_int64
+from rpython.rlib.rfloat import copysign, formatd, string_to_float
+from rpython.rlib.rstring import ParseStringError
+
+from rnumber import rnumber, rnumeric
+
+class rdouble(rnumber):
+  """An IEEE double, as used by the reference interpreter."""
+  __slots__ = ['floatval']
+
+  def __init__(self, floatval):
+    self.floatval = floatval
+
+  @staticmethod
+  def fromint(n):
+    return rdouble(float(n))
+
+  def toint(self):
+    return ovfcheck_float_to_int(self.floatval)
+
+  def tobool(self):
+    return self.floatval != 0.0
+
+  def numeric(self):
+    return DOUBLES
+
+  @jit.elidable
+  def tostr(self):
+    f = self.floatval
+    if math.floor(f) == f:
+      return formatd(f, 'f', 0)
+    return formatd(f, 'r', 0)
+
+  def dump(self, out):
+    out.int(intmask(float2longlong(self.floatval)))
+
+  def add(self, other):
+    assert isinstance(other, rdouble)
+    return rdouble(self.floatval + other.floatval)
+
+  def sub(self, other):
+    assert isinstance(other, rdouble)
+    return rdouble(self.floatval - other.floatval)
+
+  def mul(self, other):
+    assert isinstance(other, rdouble)
+    return rdouble(self.floatval * other.floatval)
+
+  def div(self, other):
+    assert isinstance(other, rdouble)
+    if other.floatval == 0.0: raise ZeroDivisionError
+    return rdouble(self.floatval / other.floatval)
+
+  def mod(self, other):
+    assert isinstance(other, rdouble)
+    a, b = self.floatval, other.floatval
+    if b == 0.0: raise ZeroDivisionError
+    m = math.fmod(a, b)
+    if m == 0.0:
+      m = copysign(0.0, b)
+    elif (m < 0.0) != (b < 0.0):
+      m += b
+    return rdouble(m)
+
+  def lt(self, other):
+    assert isinstance(other, rdouble)
+    return self.floatval < other.floatval
+
+  def eq(self, other):
+    assert isinstance(other, rdouble)
+    return self.floatval == other.floatval
+
+
+ZERO = rdouble(0.0)
+ONE  = rdouble(1.0)
+
+
+class doubles(rnumeric):
+  def fromint(self, n):
+    return rdouble.fromint(n)
+
+  def frombool(self, b):
+    if b: return ONE
+    return ZERO
+
+  def frombig(self, big):
+    return rdouble(big.tofloat())
+
+  def fromstr(self, s):
+    try:
+      return rdouble(string_to_float(s))
+    except ParseStringError:
+      raise ValueError('invalid float')
+
+  def load(self, inp):
+    return rdouble(longlong2float(r_int64(inp.int())))
+
+DOUBLES = doubles('float')
@@ -0,0 +1,388 @@
+import sys
+
+from rpython.rlib import jit
+
+CHUNK_BITS = 4
+CHUNK_SIZE = 1 << CHUNK_BITS
+CHUNK_MASK = CHUNK_SIZE - 1
+
+NO_MAX = -sys.maxint - 1
+MAX_VERSIONS = 256
+
+
+class rchunk(object):
+  __slots__ = ['codes', 'types']
+
+  def __init__(self, empty_type):
+    self.codes = [0] * (CHUNK_SIZE * CHUNK_SIZE)
+    self.types = [empty_type] * (CHUNK_SIZE * CHUNK_SIZE)
+
+
+class rversion(object):
+  """Identifies one state of the contents of a codebox."""
+  pass
+
+FROZEN = rversion()
+
+
+class rgrid(object):
+  """A codebox of `width` by `height` cells, with versioned lookups."""
+  __slots__ = ['width', 'height', 'empty_type', 'frozen', 'version', 'versions',
+               'codes', 'types', 'rmax', 'cmax', 'chunks', 'sparse_rmax', 'sparse_cmax',
+               'has_jumps', 'rnext', 'rprev', 'rfirst', 'rlast',
+               'cnext', 'cprev', 'cfirst', 'clast']
+  _immutable_fields_ = ['width', 'height', 'empty_type', 'frozen', 'version?']
+
+  def __init__(self, width, height, empty_type, frozen = False):
+    self.width = width
+    self.height = height
+    self.empty_type = empty_type
+    self.frozen = frozen
+    self.version = rversion()
+    self.versions = 0
+    self.codes = []
+    self.types = []
+    for _ in range(height):
+      self.codes.append([])
+      self.types.append([])
+    self.rmax = [NO_MAX] * height
+    self.cmax = [NO_MAX] * width
+    self.chunks = {}
+    self.sparse_rmax = {}
+    self.sparse_cmax = {}
+    self.has_jumps = False
+    self.rnext = []
+    self.rprev = []
+    self.rfirst = []
+    self.rlast = []
+    self.cnext = []
+    self.cprev = []
+    self.cfirst = []
+    self.clast = []
+
+  def current(self):
+    """Returns the version lookups fold against, or None."""
+    if self.frozen:
+      return FROZEN
+    return self.version
+
+  def changed(self):
+    if self.version is None:
+      return
+    self.versions += 1
+    if self.versions > MAX_VERSIONS:
+      self.version = None
+    else:
+      self.version = rversion()
+
+  def get(self, x, y):
+    version = self.current()
+    if version is None:
+      return self.load(x, y)
+    return self.get_at(x, y, version)
+
+  @jit.elidable
+  def get_at(self, x, y, version):
+    return self.load(x, y)
+
+  def load(self, x, y):
+    if 0 <= y < self.height and 0 <= x < self.width:
+      row = self.codes[y]
+      if x < len(row):
+        return row[x], self.types[y][x]
+      return 0, self.empty_type
+    key = (x >> CHUNK_BITS, y >> CHUNK_BITS)
+    if key in self.chunks:
+      chunk = self.chunks[key]
+      i = ((y & CHUNK_MASK) << CHUNK_BITS) | (x & CHUNK_MASK)
+      return chunk.codes[i], chunk.types[i]
+    return 0, self.empty_type
+
+  def put(self, x, y, code, type):
+    """Writes a cell, and returns whether the codebox has changed."""
+    if not self.has_jumps:
+      self.store(x, y, code, type)
+      return True
+    if self.frozen:
+      raise RuntimeError('write to a frozen codebox')
+    old_code, old_type = self.load(x, y)
+    old_rmax = self.row_max(y)
+    old_cmax = self.col_max(x)
+    self.store(x, y, code, type)
+    changed = (old_type == self.empty_type) != (type == self.empty_type)
+    row_changed = self.row_max(y) != old_rmax
+    col_changed = self.col_max(x) != old_cmax
+    if 0 <= y < self.height and (changed or row_changed):
+      self.jump_row(y)
+    if 0 <= x < self.width and (changed or col_changed):
+      self.jump_col(x)
+    if old_code != code or row_changed or col_changed:
+      self.changed()
+      return True
+    return False
+
+  def store(self, x, y, code, type):
+    if 0 <= y < self.height and 0 <= x < self.width:
+      row = self.codes[y]
+      types = self.types[y]
+      if x >= len(row):
+        pad = x - len(row) + 1
+        row.extend([0] * pad)
+        types.extend([self.empty_type] * pad)
+      row[x] = code
+      types[x] = type
+    else:
+      key = (x >> CHUNK_BITS, y >> CHUNK_BITS)
+      if key in self.chunks:
+        chunk = self.chunks[key]
+      else:
+        chunk = rchunk(self.empty_type)
+        self.chunks[key] = chunk
+      i = ((y & CHUNK_MASK) << CHUNK_BITS) | (x & CHUNK_MASK)
+      chunk.codes[i] = code
+      chunk.types[i] = type
+
+    if 0 <= y < self.height:
+      if self.rmax[y] == NO_MAX or x > self.rmax[y]:
+        self.rmax[y] = x
+    elif y not in self.sparse_rmax or x > self.sparse_rmax[y]:
+      self.sparse_rmax[y] = x
+
+    if 0 <= x < self.width:
+      if self.cmax[x] == NO_MAX or y > self.cmax[x]:
+        self.cmax[x] = y
+    elif x not in self.sparse_cmax or y > self.sparse_cmax[x]:
+      self.sparse_cmax[x] = y
+
+  def dump(self, out):
+    """Encodes the codebox, with the extent of each row and column."""
+    for n in [self.width, self.height, self.empty_type, int(self.frozen), self.versions]:
+      out.int(n)
+    for y in range(self.height):
+      row = self.codes[y]
+      types = self.types[y]
+      out.int(len(row))
+      for x in range(len(row)):
+        out.int(row[x])
+        out.int(types[x])
+    for m in self.rmax:
+      out.int(m)
+    for m in self.cmax:
+      out.int(m)
+    for table in [self.sparse_rmax, self.sparse_cmax]:
+      out.int(len(table))
+      for k, m in table.items():
+        out.int(k)
+        out.int(m)
+    out.int(len(self.chunks))
+    for key, chunk in self.chunks.items():
+      cx, cy = key
+      out.int(cx)
+      out.int(cy)
+      for i in range(CHUNK_SIZE * CHUNK_SIZE):
+        out.int(chunk.codes[i])
+        out.int(chunk.types[i])
+
+  @staticmethod
+  def restore(inp):
+    """Decodes a codebox written by `dump`, and builds its jump tables."""
+    width, height, empty_type = inp.int(), inp.int(), inp.int()
+    frozen, versions = inp.int() != 0, inp.int()
+    if width < 0 or height < 0:
+      raise ValueError('corrupt snapshot')
+    grid = rgrid(width, height, empty_type, frozen)
+    for y in range(height):
+      n = inp.int()
+      if not 0 <= n <= width:
+        raise ValueError('corrupt snapshot')
+      for _ in range(n):
+        grid.codes[y].append(inp.int())
+        grid.types[y].append(inp.int())
+    for y in range(height):
+      grid.rmax[y] = inp.int()
+    for x in range(width):
+      grid.cmax[x] = inp.int()
+    for table in [grid.sparse_rmax, grid.sparse_cmax]:
+      for _ in range(inp.int()):
+        k = inp.int()
+        table[k] = inp.int()
+    for _ in range(inp.int()):
+      cx = inp.int()
+      cy = inp.int()
+      chunk = rchunk(empty_type)
+      for i in range(CHUNK_SIZE * CHUNK_SIZE):
+        chunk.codes[i] = inp.int()
+        chunk.types[i] = inp.int()
+      grid.chunks[(cx, cy)] = chunk
+    grid.versions = versions
+    if versions > MAX_VERSIONS:
+      grid.version = None
+    grid.build_jumps()
+    return grid
+
+  def row_max(self, y):
+    if 0 <= y < self.height:
+      m = self.rmax[y]
+    else:
+      m = self.sparse_rmax.get(y, NO_MAX)
+    if m == NO_MAX:
+      return 0
+    return m
+
+  def col_max(self, x):
+    if 0 <= x < self.width:
+      m = self.cmax[x]
+    else:
+      m = self.sparse_cmax.get(x, NO_MAX)
+    if m == NO_MAX:
+      return 0
+    return m
+
+  def is_noop(self, x, y):
+    types = self.types[y]
+    return x >= len(types) or types[x] == self.empty_type
+
+  def step(self, x, y, dx, dy):
+    version = self.current()
+    if version is None:
+      return self.step_from(x, y, dx, dy)
+    return self.step_at(x, y, dx, dy, version)
+
+  @jit.elidable
+  def step_at(self, x, y, dx, dy, version):
+    return self.step_from(x, y, dx, dy)
+
+  def step_from(self, x, y, dx, dy):
+    nx = x + dx
+    rmax = self.row_max(y)
+    if nx < 0 or nx > rmax:
+      if dx < 0:
+        nx = rmax
+      elif dx > 0:
+        nx = 0
+
+    ny = y + dy
+    cmax = self.col_max(x)
+    if ny < 0 or ny > cmax:
+      if dy < 0:
+        ny = cmax
+      elif dy > 0:
+        ny = 0
+
+    return nx, ny
+
+  def jump(self, x, y, dx, dy):
+    """Steps to the next cell in the direction of travel which is not a no-op."""
+    version = self.current()
+    if version is None:
+      return self.jump_from(x, y, dx, dy)
+    return self.jump_at(x, y, dx, dy, version)
+
+  @jit.elidable
+  def jump_at(self, x, y, dx, dy, version):
+    return self.jump_from(x, y, dx, dy)
+
+  def jump_from(self, x, y, dx, dy):
+    n = -1
+    if dy == 0 and 0 <= y < self.height:
+      if dx > 0:
+        table = self.rnext[y]
+        if x >= len(table):
+          n = self.rfirst[y]
+        elif x >= 0:
+          n = table[x]
+      else:
+        table = self.rprev[y]
+        if x >= len(table) or x < 0:
+          n = self.rlast[y]
+        else:
+          n = table[x]
+      if n >= 0:
+        return n, y
+    elif dx == 0 and 0 <= x < self.width:
+      if dy > 0:
+        table = self.cnext[x]
+        if y >= len(table):
+          n = self.cfirst[x]
+        elif y >= 0:
+          n = table[y]
+      else:
+        table = self.cprev[x]
+        if y >= len(table) or y < 0:
+          n = self.clast[x]
+        else:
+          n = table[y]
+      if n >= 0:
+        return x, n
+    return self.step_from(x, y, dx, dy)
+
+  def build_jumps(self):
+    self.rnext = [[]] * self.height
+    self.rprev = [[]] * self.height
+    self.rfirst = [-1] * self.height
+    self.rlast = [-1] * self.height
+    self.cnext = [[]] * self.width
+    self.cprev = [[]] * self.width
+    self.cfirst = [-1] * self.width
+    self.clast = [-1] * self.width
+    for y in range(self.height):
+      self.jump_row(y)
+    for x in range(self.width):
+      self.jump_col(x)
+    self.has_jumps = True
+
+  def jump_row(self, y):
+    rmax = self.row_max(y)
+    first, last = -1, -1
+    forward, backward = [], []
+    if 0 <= rmax < self.width:
+      for x in range(rmax + 1):
+        if not self.is_noop(x, y):
+          if first < 0:
+            first = x
+          last = x
+      if first >= 0:
+        forward = [-1] * (rmax + 1)
+        backward = [-1] * (rmax + 1)
+        n = first
+        for x in range(rmax, -1, -1):
+          forward[x] = n
+          if not self.is_noop(x, y):
+            n = x
+        p = last
+        for x in range(rmax + 1):
+          backward[x] = p
+          if not self.is_noop(x, y):
+            p = x
+    self.rnext[y] = forward
+    self.rprev[y] = backward
+    self.rfirst[y] = first
+    self.rlast[y] = last
+
+  def jump_col(self, x):
+    cmax = self.col_max(x)
+    first, last = -1, -1
+    forward, backward = [], []
+    if 0 <= cmax < self.height:
+      for y in range(cmax + 1):
+        if not self.is_noop(x, y):
+          if first < 0:
+            first = y
+          last = y
+      if first >= 0:
+        forward = [-1] * (cmax + 1)
+        backward = [-1] * (cmax + 1)
+        n = first
+        for y in range(cmax, -1, -1):
+          forward[y] = n
+          if not self.is_noop(x, y):
+            n = y
+        p = last
+        for y in range(cmax + 1):
+          backward[y] = p
+          if not self.is_noop(x, y):
+            p = y
+    self.cnext[x] = forward
+    self.cprev[x] = backward
+    self.cfirst[x] = first
+    self.clast[x] = last
@@ -0,0 +1,172 @@
+from rpython.rlib import jit
+from rpython.rlib.rarithmetic import ovfcheck
+from rpython.rlib.rbigint import rbigint
+
+from rdecimal import parse_decimal, strip_zeros
+from rnumber import rnumber, rnumeric
+
+class rinteger(rnumber):
+  """An integer of any size, unboxed in `intval` when it fits."""
+  __slots__ = ['big', 'intval']
+
+  def __init__(self, big, intval = 0):
+    self.big = big
+    self.intval = intval
+
+  @property
+  def n(self):
+    if self.big is None:
+      return rbigint.fromint(self.intval)
+    return self.big
+
+  @staticmethod
+  def fromint(n):
+    return rinteger(None, n)
+
+  @staticmethod
+  def frombig(big):
+    if big.numdigits() == 1:
+      return rinteger(None, big.toint())
+    return rinteger(big)
+
+  def toint(self):
+    if self.big is None:
+      return self.intval
+    return self.big.toint()
+
+  def tobool(self):
+    if self.big is None:
+      return self.intval != 0
+    return self.big.tobool()
+
+  def numeric(self):
+    return INTEGERS
+
+  def isword(self):
+    return self.big is None
+
+  def tobig(self):
+    return self.n
+
+  @jit.elidable
+  def tostr(self):
+    if self.big is None:
+      return str(self.intval)
+    return self.big.str()
+
+  def dump(self, out):
+    if self.big is None:
+      out.int(0)
+      out.int(self.intval)
+    else:
+      out.int(1)
+      out.big(self.big)
+
+  def add(self, other):
+    assert isinstance(other, rinteger)
+    if self.big is None and other.big is None:
+      try:
+        return rinteger.fromint(ovfcheck(self.intval + other.intval))
+      except OverflowError:
+        pass
+    return self._add(other)
+
+  @jit.elidable
+  def _add(self, other):
+    return rinteger.frombig(self.n.add(other.n))
+
+  def sub(self, other):
+    assert isinstance(other, rinteger)
+    if self.big is None and other.big is None:
+      try:
+        return rinteger.fromint(ovfcheck(self.intval - other.intval))
+      except OverflowError:
+        pass
+    return self._sub(other)
+
+  @jit.elidable
+  def _sub(self, other):
+    return rinteger.frombig(self.n.sub(other.n))
+
+  def mul(self, other):
+    assert isinstance(other, rinteger)
+    if self.big is None and other.big is None:
+      try:
+        return rinteger.fromint(ovfcheck(self.intval * other.intval))
+      except OverflowError:
+        pass
+    return self._mul(other)
+
+  @jit.elidable
+  def _mul(self, other):
+    return rinteger.frombig(self.n.mul(other.n))
+
+  def div(self, other):
+    assert isinstance(other, rinteger)
+    if self.big is None and other.big is None:
+      a, b = self.intval, other.intval
+      if b == 0: raise ZeroDivisionError
+      if b != -1:
+        return rinteger.fromint(a // b)
+    return self._div(other)
+
+  @jit.elidable
+  def _div(self, other):
+    if other.n.get_sign() == 0: raise ZeroDivisionError
+    return rinteger.frombig(self.n.floordiv(other.n))
+
+  def mod(self, other):
+    assert isinstance(other, rinteger)
+    if self.big is None and other.big is None:
+      a, b = self.intval, other.intval
+      if b == 0: raise ZeroDivisionError
+      if b == -1: return ZERO
+      return rinteger.fromint(a % b)
+    return self._mod(other)
+
+  @jit.elidable
+  def _mod(self, other):
+    if other.n.get_sign() == 0: raise ZeroDivisionError
+    return rinteger.frombig(self.n.mod(other.n))
+
+  def lt(self, other):
+    assert isinstance(other, rinteger)
+    if self.big is None and other.big is None:
+      return self.intval < other.intval
+    return self.n.lt(other.n)
+
+  def eq(self, other):
+    assert isinstance(other, rinteger)
+    if self.big is None and other.big is None:
+      return self.intval == other.intval
+    return self.n.eq(other.n)
+
+
+ZERO = rinteger.fromint(0)
+ONE  = rinteger.fromint(1)
+
+
+class integers(rnumeric):
+  def fromint(self, n):
+    return rinteger.fromint(n)
+
+  def frombool(self, b):
+    if b: return ONE
+    return ZERO
+
+  def frombig(self, big):
+    return rinteger.frombig(big)
+
+  def fromstr(self, s):
+    n, places = parse_decimal(s)
+    n, places = strip_zeros(n, places)
+    if places > 0:
+      raise ValueError('not an integer')
+    return rinteger.frombig(n)
+
+  def load(self, inp):
+    if inp.int() == 0:
+      return rinteger.fromint(inp.int())
+    return rinteger.frombig(inp.big())
+
+INTEGERS = integers('int')
@@ -0,0 +1,105 @@
+from rpython.rlib import jit_hooks
+from rpython.rlib.jit import JitHookInterface, Counters
+from rpython.rlib.objectmodel import we_are_translated
+from rpython.rlib.rfloat import formatd
+
+LOCATIONS = 10
+
+
+class rjitstats(object):
+  """Counts of the traces compiled and aborted, once `enabled`."""
+  __slots__ = ['enabled', 'loops', 'bridges', 'aborts', 'reasons', 'locations']
+  _immutable_fields_ = ['enabled?']
+
+  def __init__(self):
+    self.enabled = False
+    self.loops = 0
+    self.bridges = 0
+    self.aborts = 0
+    self.reasons = {}
+    self.locations = {}
+
+  def enable(self):
+    """Starts counting, and has the JIT's profiler count bridge entries."""
+    if self.enabled:
+      # Never reached; annotates the fields the hooks set.
+      reason = Counters.counter_names[Counters.ABORT_TOO_LONG]
+      self.compiled(self.enabled)
+      self.abort(reason, reason)
+    self.enabled = True
+    if we_are_translated():
+      jit_hooks.stats_set_debug(None, True)
+
+  def compiled(self, bridge):
+    if bridge:
+      self.bridges += 1
+    else:
+      self.loops += 1
+
+  def abort(self, reason, location):
+    self.aborts += 1
+    self.reasons[reason] = self.reasons.get(reason, 0) + 1
+    self.locations[location] = self.locations.get(location, 0) + 1
+
+  def report(self):
+    lines = ['jit stats:',
+             '  loops compiled     %d' % self.loops,
+             '  bridges compiled   %d' % self.bridges]
+    if we_are_translated() and (self.loops or self.bridges or self.aborts):
+      entries = 0
+      runs = jit_hooks.stats_get_loop_run_times(None)
+      for i in range(len(runs)):
+        if runs[i].type == 'b':
+          entries += runs[i].counter
+      tracing = jit_hooks.stats_get_times_value(None, Counters.TRACING)
+      backend = jit_hooks.stats_get_times_value(None, Counters.BACKEND)
+      lines.append('  bridge entries     %d' % entries)
+      lines.append('  time tracing       %ss' % formatd(tracing, 'f', 3))
+      lines.append('  time in backend    %ss' % formatd(backend, 'f', 3))
+    lines.append('  traces aborted     %d' % self.aborts)
+    for reason, n in self.reasons.items():
+      lines.append('    %s %d' % (reason.lower(), n))
+    if self.locations:
+      top = []
+      for location, n in self.locations.items():
+        i = len(top)
+        while i > 0 and top[i-1][0] < n:
+          i -= 1
+        if i < LOCATIONS:
+          assert i >= 0
+          top.insert(i, (n, location))
+          if len(top) > LOCATIONS:
+            top.pop()
+      lines.append('  most aborted at:')
+      for n, location in top:
+        lines.append('    %s %d' % (location, n))
+    return '\n'.join(lines) + '\n'
+
+
+class rjithooks(JitHookInterface):
+  """Forwards compilation events to an enabled `rjitstats`."""
+
+  def __init__(self, stats):
+    self.stats = stats
+
+  def on_abort(self, reason, jitdriver, greenkey, greenkey_repr, logops, operations):
+    if self.stats.enabled:
+      self.stats.abort(Counters.counter_names[reason], location(greenkey_repr))
+
+  def on_trace_too_long(self, jitdriver, greenkey, greenkey_repr):
+    if self.stats.enabled:
+      self.stats.abort('TRACE_TOO_LONG', location(greenkey_repr))
+
+  def after_compile(self, debug_info):
+    if self.stats.enabled:
+      self.stats.compiled(False)
+
+  def after_compile_bridge(self, debug_info):
+    if self.stats.enabled:
+      self.stats.compiled(True)
+
+
+def location(greenkey_repr):
+  if greenkey_repr is None:
+    return '?'
+  return greenkey_repr
@@ -0,0 +1,31 @@
+from rstorage import rbigs, rwords
+
+class rnumber(object):
+  """A value on the stack, of one numeric backend per run."""
+  __slots__ = []
+
+  def gt(self, other):
+    return other.lt(self)
+
+  def isword(self):
+    """Whether the value is a machine word integer."""
+    return False
+
+  def tobig(self):
+    """The value as an rbigint, or None if it is not an integer."""
+    return None
+
+  def write(self, output, places):
+    """Writes the value, to at most `places` digits if not negative."""
+    output.write(self.tostr())
+
+
+class rnumeric(object):
+  """Makes the values of one numeric backend."""
+  _immutable_fields_ = ['name', 'digits[*]', 'words', 'bigs']
+
+  def __init__(self, name):
+    self.name = name
+    self.digits = [self.fromint(i) for i in range(16)]
+    self.words = rwords(self)
+    self.bigs = rbigs(self)
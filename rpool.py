@@ -0,0 +1,105 @@
+import os
+from rpython.rlib.rpoll import poll, PollError, POLLIN
+from rpython.rlib.rstring import StringBuilder
+
+READ_SIZE = 1 << 16
+
+
+class rjob(object):
+  """A forked job, with the pipes of its stdout and stderr."""
+  __slots__ = ['pid', 'out', 'err', 'open', 'status']
+
+  def __init__(self, pid):
+    self.pid = pid
+    self.out = StringBuilder()
+    self.err = StringBuilder()
+    self.open = 2
+    self.status = -1
+
+
+class rpool(object):
+  """Runs `count` jobs in up to `workers` forked processes at once."""
+  __slots__ = ['workers', 'count', 'jobs', 'pipes', 'started', 'running', 'finished']
+
+  def __init__(self, workers, count):
+    self.workers = workers
+    self.count = count
+    self.jobs = [None] * count
+    self.pipes = {}
+    self.started = 0
+    self.running = 0
+    self.finished = 0
+
+  def start(self, batch):
+    i = self.started
+    out_r, out_w = os.pipe()
+    err_r, err_w = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+      # The child must never return into the parent's code, whatever fails.
+      code = 1
+      try:
+        null = os.open('/dev/null', os.O_RDONLY, 0)
+        os.dup2(null, 0)
+        os.dup2(out_w, 1)
+        os.dup2(err_w, 2)
+        for fd in [null, out_r, out_w, err_r, err_w]:
+          os.close(fd)
+        for fd in self.pipes:
+          os.close(fd)
+        code = batch.work(i)
+      except Exception:
+        code = 1
+      finally:
+        os._exit(code)
+    os.close(out_w)
+    os.close(err_w)
+    self.jobs[i] = rjob(pid)
+    self.pipes[out_r] = i << 1
+    self.pipes[err_r] = (i << 1) | 1
+    self.started += 1
+    self.running += 1
+
+  def read(self, fd):
+    key = self.pipes[fd]
+    job = self.jobs[key >> 1]
+    data = os.read(fd, READ_SIZE)
+    if data:
+      if key & 1:
+        job.err.append(data)
+      else:
+        job.out.append(data)
+      return
+    os.close(fd)
+    del self.pipes[fd]
+    job.open -= 1
+    if job.open == 0:
+      _, status = os.waitpid(job.pid, 0)
+      self.running -= 1
+      if os.WIFEXITED(status):
+        job.status = os.WEXITSTATUS(status)
+      else:
+        job.status = 128 + os.WTERMSIG(status)
+
+  def run(self, batch):
+    """Runs every job, and passes their results to `batch.write` in order."""
+    while self.finished < self.count:
+      while self.started < self.count and self.running < self.workers:
+        self.start(batch)
+      events = {}
+      for fd in self.pipes:
+        events[fd] = POLLIN
+      if events:
+        try:
+          ready = poll(events, -1)
+        except PollError:
+          ready = []
+        for fd, _ in ready:
+          self.read(fd)
+      while self.finished < self.count:
+        job = self.jobs[self.finished]
+        if job is None or job.status < 0:
+          break
+        batch.write(self.finished, job.out.build(), job.err.build(), job.status)
+        self.jobs[self.finished] = None
+        self.finished += 1
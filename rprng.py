@@ -0,0 +1,38 @@
+from rpython.rlib.rarithmetic import intmask, r_uint64
+
+MULTIPLIER = r_uint64(0x2545F4914F6CDD1D)
+
+
+def splitmix(n):
+  """Scrambles a seed, so that nearby seeds start far apart."""
+  n += r_uint64(0x9E3779B97F4A7C15)
+  n = (n ^ (n >> 30)) * r_uint64(0xBF58476D1CE4E5B9)
+  n = (n ^ (n >> 27)) * r_uint64(0x94D049BB133111EB)
+  return n ^ (n >> 31)
+
+
+class rprng(object):
+  """An xorshift64* generator, for `x`."""
+  __slots__ = ['state']
+
+  def __init__(self, state):
+    self.state = state
+
+  @staticmethod
+  def fromseed(seed):
+    state = splitmix(r_uint64(seed))
+    if not state:
+      state = MULTIPLIER
+    return rprng(state)
+
+  def next(self):
+    x = self.state
+    x ^= x >> 12
+    x ^= x << 25
+    x ^= x >> 27
+    self.state = x
+    return x * MULTIPLIER
+
+  def direction(self):
+    """One of 0 to 3, from the top bits, which are the best mixed."""
+    return intmask(self.next() >> 62)
@@ -0,0 +1,154 @@
+from rpython.rlib.listsort import make_timsort_class
+from rpython.rlib.rutf8 import unichr_as_utf8
+
+HEAT = ' .:-=+*#%@'
+ARROWS = '>v<^'
+HOTSPOTS = 20
+
+
+def by_count(a, b):
+  """Orders (count, x, y, d) entries by descending count, then position."""
+  if a[0] != b[0]:
+    return a[0] > b[0]
+  if a[2] != b[2]:
+    return a[2] < b[2]
+  if a[1] != b[1]:
+    return a[1] < b[1]
+  return a[3] < b[3]
+
+CountSort = make_timsort_class(lt=by_count)
+
+
+def direction(dx, dy):
+  if dx > 0: return 0
+  if dy > 0: return 1
+  if dx < 0: return 2
+  return 3
+
+def bits(n):
+  b = 0
+  while n:
+    n >>= 1
+    b += 1
+  return b
+
+def rjust(s, width):
+  return ' ' * (width - len(s)) + s
+
+def percent(n, total):
+  if total == 0:
+    return '0.0'
+  p = n * 1000 // total
+  return '%d.%d' % (p // 10, p % 10)
+
+def symbol(code):
+  if 32 < code < 127 or 160 < code < 0x110000:
+    return unichr_as_utf8(code)
+  return '\\x%x' % code
+
+
+class rprofile(object):
+  """Execution counts per cell, direction and opcode of a codebox."""
+  __slots__ = ['width', 'height', 'steps', 'cells', 'outside', 'opcodes',
+               'writes', 'written', 'frames', 'max_depth']
+
+  def __init__(self, width, height):
+    self.width = width
+    self.height = height
+    self.steps = 0
+    self.cells = [0] * (width * height * 4)
+    self.outside = {}
+    self.opcodes = {}
+    self.writes = 0
+    self.written = {}
+    self.frames = 0
+    self.max_depth = 0
+
+  def step(self, x, y, dx, dy, code):
+    self.steps += 1
+    d = direction(dx, dy)
+    if 0 <= x < self.width and 0 <= y < self.height:
+      i = ((y * self.width + x) << 2) | d
+      self.cells[i] += 1
+    else:
+      key = (x, y, d)
+      self.outside[key] = self.outside.get(key, 0) + 1
+    self.opcodes[code] = self.opcodes.get(code, 0) + 1
+
+  def write(self, x, y):
+    self.writes += 1
+    key = (x, y)
+    self.written[key] = self.written.get(key, 0) + 1
+
+  def frame(self, depth):
+    self.frames += 1
+    if depth > self.max_depth:
+      self.max_depth = depth
+
+  def heat(self, x, y):
+    i = (y * self.width + x) << 2
+    return self.cells[i] + self.cells[i+1] + self.cells[i+2] + self.cells[i+3]
+
+  def report(self, name, program):
+    """Formats the counts, with the hot cells as they are in `program`."""
+    lines = ['profile of %s' % name,
+             '  %d instructions, %d writes by p, %d frames opened, max depth %d' % (
+               self.steps, self.writes, self.frames, self.max_depth),
+             '']
+
+    hottest = 0
+    for y in range(self.height):
+      for x in range(self.width):
+        hottest = max(hottest, self.heat(x, y))
+    scale = max(bits(hottest) - 1, 1)
+    lines.append('heatmap (log scale, "%s" hottest):' % HEAT[len(HEAT) - 1])
+    for y in range(self.height):
+      row = []
+      for x in range(self.width):
+        n = self.heat(x, y)
+        if n == 0:
+          row.append(HEAT[0])
+        else:
+          row.append(HEAT[1 + (bits(n) - 1) * (len(HEAT) - 2) // scale])
+      lines.append('  |' + ''.join(row) + '|')
+    lines.append('')
+
+    cells = []
+    for i in range(len(self.cells)):
+      if self.cells[i]:
+        cells.append((self.cells[i], (i >> 2) % self.width, (i >> 2) // self.width, i & 3))
+    for key, n in self.outside.items():
+      x, y, d = key
+      cells.append((n, x, y, d))
+    CountSort(cells).sort()
+    lines.append('hotspots:')
+    lines.append('       count      %       x       y  dir  op')
+    for n, x, y, d in cells[:HOTSPOTS]:
+      code, _ = program.get(x, y)
+      lines.append('  ' + rjust('%d' % n, 10) + rjust(percent(n, self.steps), 7) +
+                   rjust('%d' % x, 8) + rjust('%d' % y, 8) + '    ' + ARROWS[d] + '  ' +
+                   symbol(code))
+    lines.append('')
+
+    opcodes = []
+    for code, n in self.opcodes.items():
+      opcodes.append((n, code, 0, 0))
+    CountSort(opcodes).sort()
+    lines.append('opcodes:')
+    for n, code, _, _ in opcodes:
+      lines.append('  ' + rjust(symbol(code), 4) + rjust('%d' % n, 12) +
+                   rjust(percent(n, self.steps), 7))
+
+    if self.written:
+      written = []
+      for key, n in self.written.items():
+        x, y = key
+        written.append((n, x, y, 0))
+      CountSort(written).sort()
+      lines.append('')
+      lines.append('cells written by p:')
+      lines.append('       count       x       y')
+      for n, x, y, _ in written[:HOTSPOTS]:
+        lines.append('  ' + rjust('%d' % n, 10) + rjust('%d' % x, 8) + rjust('%d' % y, 8))
+
+    return '\n'.join(lines) + '\n'
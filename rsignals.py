@@ -0,0 +1,58 @@
+import os
+
+from rpython.rlib.objectmodel import we_are_translated
+from rpython.rlib.rarithmetic import intmask
+from rpython.rlib.rsignal import pypysig_default, pypysig_ignore, pypysig_poll, pypysig_setflag, SIGINT, SIGTERM, SIGUSR1
+
+NO_REQUEST, WRITE, STOP = range(3)
+
+
+class Interrupted(Exception):
+  """Raised by a read which a request to stop has interrupted."""
+  pass
+
+
+class rsignals(object):
+  """The request of a signal which has been polled, but not acted on yet."""
+  __slots__ = ['pending']
+
+  def __init__(self):
+    self.pending = NO_REQUEST
+
+SIGNALS = rsignals()
+
+
+def watch_signals():
+  """Asks for a snapshot on SIGUSR1, and a snapshot and exit on SIGTERM."""
+  if we_are_translated():
+    pypysig_setflag(SIGUSR1)
+    pypysig_setflag(SIGTERM)
+
+def unwatch_signals():
+  """Restores the default actions, once there is nothing to snapshot."""
+  if we_are_translated():
+    stop = poll_signals() == STOP
+    pypysig_ignore(SIGUSR1)
+    pypysig_default(SIGTERM)
+    if stop:
+      os.kill(os.getpid(), SIGTERM)
+
+def poll_signals():
+  """Returns what the signals since the last poll ask for."""
+  request = SIGNALS.pending
+  SIGNALS.pending = NO_REQUEST
+  if we_are_translated():
+    while True:
+      sig = intmask(pypysig_poll())
+      if sig < 0:
+        break
+      if sig == SIGTERM or sig == SIGINT:
+        request = STOP
+      elif sig == SIGUSR1 and request == NO_REQUEST:
+        request = WRITE
+  return request
+
+def stop_requested():
+  """Whether a signal has asked to stop, without consuming it."""
+  SIGNALS.pending = poll_signals()
+  return SIGNALS.pending == STOP
@@ -0,0 +1,206 @@
+import os
+
+from rpython.rlib.rarithmetic import intmask, r_uint, r_uint64
+from rpython.rlib.rbigint import rbigint
+from rpython.rlib.rstring import StringBuilder
+
+from rdeque import rdeque
+from rgrid import rgrid
+from rprng import rprng
+from rstdio import write_all
+
+MAGIC = 'FISHCKPT'
+VERSION = 2
+
+class Stopped(Exception):
+  """Raised once a snapshot has been written on SIGTERM."""
+  pass
+
+
+class rencoder(object):
+  """Builds a snapshot, with integers as zigzag varints."""
+  __slots__ = ['builder']
+
+  def __init__(self):
+    self.builder = StringBuilder()
+
+  def int(self, n):
+    u = (r_uint(n) << 1) ^ r_uint(n >> 63)
+    while u >= 0x80:
+      self.builder.append(chr(intmask(u & 0x7F) | 0x80))
+      u >>= 7
+    self.builder.append(chr(intmask(u)))
+
+  def magic(self):
+    self.builder.append(MAGIC)
+
+  def bytes(self, s):
+    self.int(len(s))
+    self.builder.append(s)
+
+  def big(self, n):
+    self.bytes(n.tobytes(n.bit_length() // 8 + 1, 'little', True))
+
+  def build(self):
+    return self.builder.build()
+
+
+class rdecoder(object):
+  """Reads an `rencoder`'s output, raising ValueError if it ends early."""
+  __slots__ = ['data', 'pos']
+
+  def __init__(self, data):
+    self.data = data
+    self.pos = 0
+
+  def byte(self):
+    if self.pos >= len(self.data):
+      raise ValueError('truncated snapshot')
+    c = ord(self.data[self.pos])
+    self.pos += 1
+    return c
+
+  def int(self):
+    u = r_uint(0)
+    shift = 0
+    while True:
+      c = self.byte()
+      if shift > 63:
+        raise ValueError('corrupt snapshot')
+      u |= r_uint(c & 0x7F) << shift
+      shift += 7
+      if c < 0x80:
+        break
+    return intmask(u >> 1) ^ -intmask(u & 1)
+
+  def bytes(self):
+    n = self.int()
+    start = self.pos
+    if n < 0 or n > len(self.data) - start:
+      raise ValueError('truncated snapshot')
+    end = start + n
+    assert end >= 0
+    self.pos = end
+    return self.data[start:end]
+
+  def big(self):
+    return rbigint.frombytes(self.bytes(), 'little', True)
+
+
+class rsnapshot(object):
+  """The state of `run` at the top of its loop."""
+  __slots__ = ['numeric', 'program', 'pcx', 'pcy', 'dx', 'dy', 'skip', 'slurp',
+               'slurp_char', 'frames', 'registers', 'register', 'prng']
+
+  def __init__(self, numeric, program, pcx, pcy, dx, dy, skip, slurp, slurp_char,
+               frames, registers, register, prng):
+    self.numeric = numeric
+    self.program = program
+    self.pcx = pcx
+    self.pcy = pcy
+    self.dx = dx
+    self.dy = dy
+    self.skip = skip
+    self.slurp = slurp
+    self.slurp_char = slurp_char
+    self.frames = frames
+    self.registers = registers
+    self.register = register
+    self.prng = prng
+
+  def stack(self):
+    return rdeque.fromframes(self.frames)
+
+  def dump(self):
+    out = rencoder()
+    out.magic()
+    out.int(VERSION)
+    out.bytes(self.numeric.name)
+    for n in [self.pcx, self.pcy, self.dx, self.dy, int(self.skip), int(self.slurp), self.slurp_char]:
+      out.int(n)
+    out.int(intmask(self.prng.state))
+    self.program.dump(out)
+    out.int(len(self.frames))
+    for frame in self.frames:
+      out.int(len(frame))
+      for value in frame:
+        value.dump(out)
+    out.int(len(self.registers))
+    for value in self.registers:
+      dump_register(out, value)
+    dump_register(out, self.register)
+    return out.build()
+
+  @staticmethod
+  def load(data, numerics):
+    """Reads a snapshot written with any of the backends in `numerics`."""
+    if not data.startswith(MAGIC):
+      raise ValueError('not a snapshot')
+    inp = rdecoder(data)
+    inp.pos = len(MAGIC)
+    if inp.int() != VERSION:
+      raise ValueError('unsupported snapshot version')
+    name = inp.bytes()
+    if name not in numerics:
+      raise ValueError('unknown numeric backend')
+    numeric = numerics[name]
+    pcx, pcy, dx, dy = inp.int(), inp.int(), inp.int(), inp.int()
+    skip, slurp, slurp_char = inp.int() != 0, inp.int() != 0, inp.int()
+    prng = rprng(r_uint64(inp.int()))
+    if not prng.state:
+      raise ValueError('corrupt snapshot')
+    program = rgrid.restore(inp)
+    frames = []
+    for _ in range(inp.int()):
+      frame = []
+      for _ in range(inp.int()):
+        frame.append(numeric.load(inp))
+      frames.append(frame)
+    if not frames:
+      raise ValueError('corrupt snapshot')
+    registers = []
+    for _ in range(inp.int()):
+      registers.append(load_register(inp, numeric))
+    if len(registers) != len(frames) - 1:
+      raise ValueError('corrupt snapshot')
+    register = load_register(inp, numeric)
+    return rsnapshot(numeric, program, pcx, pcy, dx, dy, skip, slurp, slurp_char,
+                     frames, registers, register, prng)
+
+
+def dump_register(out, value):
+  if value is None:
+    out.int(0)
+  else:
+    out.int(1)
+    value.dump(out)
+
+def load_register(inp, numeric):
+  if inp.int() == 0:
+    return None
+  return numeric.load(inp)
+
+
+def write_snapshot(path, data):
+  """Replaces the file at `path` by way of a temporary file."""
+  tmp = path + '.tmp'
+  fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0644)
+  try:
+    write_all(fd, data)
+    os.fsync(fd)
+  finally:
+    os.close(fd)
+  os.rename(tmp, path)
+
+def read_snapshot(path):
+  fd = os.open(path, os.O_RDONLY, 0)
+  chunks = []
+  try:
+    while True:
+      data = os.read(fd, 1 << 16)
+      if not data:
+        break
+      chunks.append(data)
+  finally:
+    os.close(fd)
+  return ''.join(chunks)
@@ -0,0 +1,114 @@
+from rpython.rlib import jit
+
+WINDOW = 8
+
+
+class rstack(object):
+  """The JIT's virtualizable: a `window` over the rest in `deque`."""
+  __slots__ = ['window', 'depth', 'deque', 'steps', 'limit']
+  _virtualizable_ = ['window[*]', 'depth', 'deque', 'steps', 'limit']
+
+  def __init__(self, deque, limit = 0):
+    self = jit.hint(self, access_directly=True, fresh_virtualizable=True)
+    self.window = [None] * WINDOW
+    self.depth = 0
+    self.deque = deque
+    self.steps = 0
+    self.limit = limit
+
+  def fits(self, cells):
+    """Whether `cells` more steps are within the limit."""
+    return self.limit == 0 or self.steps + cells <= self.limit
+
+  @jit.unroll_safe
+  def spill(self):
+    """Moves the window into the deque, and returns the deque."""
+    depth = jit.promote(self.depth)
+    for i in range(depth):
+      self.deque.append(self.window[i])
+      self.window[i] = None
+    self.depth = 0
+    return self.deque
+
+  @jit.unroll_safe
+  def reset(self, deque):
+    """Replaces the whole stack with `deque`."""
+    for i in range(WINDOW):
+      self.window[i] = None
+    self.depth = 0
+    self.deque = deque
+
+  def finish(self):
+    """Returns the deque holding the current frame, once a script ends."""
+    deque = self.spill()
+    deque.drop_frames()
+    return deque
+
+  def len(self):
+    return self.depth + self.deque.len()
+
+  def append(self, value):
+    if self.depth == WINDOW:
+      self.spill()
+    depth = jit.promote(self.depth)
+    assert depth >= 0
+    self.window[depth] = value
+    self.depth = depth + 1
+
+  def pop(self):
+    i = jit.promote(self.depth) - 1
+    if i < 0:
+      return self.deque.pop()
+    value = self.window[i]
+    self.window[i] = None
+    self.depth = i
+    return value
+
+  def top(self):
+    i = jit.promote(self.depth) - 1
+    if i < 0:
+      return self.deque.top()
+    return self.window[i]
+
+  def get(self, i):
+    return self.spill().get(i)
+
+  def extend(self, values):
+    self.spill().extend(values)
+
+  def dup(self):
+    self.append(self.top())
+
+  def swap(self):
+    i = jit.promote(self.depth) - 2
+    if i < 0:
+      self.spill().swap()
+      return
+    a, b = self.window[i], self.window[i + 1]
+    self.window[i] = b
+    self.window[i + 1] = a
+
+  def rot3(self):
+    i = jit.promote(self.depth) - 3
+    if i < 0:
+      self.spill().rot3()
+      return
+    a, b, c = self.window[i], self.window[i + 1], self.window[i + 2]
+    self.window[i] = c
+    self.window[i + 1] = a
+    self.window[i + 2] = b
+
+  def reverse(self):
+    self.spill().reverse()
+
+  def roll(self, n):
+    self.spill().roll(n)
+
+  def open_frame(self, n):
+    self.spill().open_frame(n)
+
+  def close_frame(self):
+    return self.spill().close_frame()
+
+  def frames(self):
+    return self.spill().frames()
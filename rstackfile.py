@@ -0,0 +1,97 @@
+import os
+
+from rpython.rlib import rmmap
+from rpython.rlib.rarithmetic import intmask, r_uint
+
+from rdeque import rdeque, capacity_for
+
+FORMATS = {'text': 0, 'int32': 4, 'int64': 8}
+MAX_DIGITS = 18
+
+
+def read_stack_file(path, width, numeric):
+  """Returns a deque of the values in the file at `path`."""
+  fd = os.open(path, os.O_RDONLY, 0)
+  try:
+    if os.fstat(fd).st_size == 0:
+      return rdeque()
+    try:
+      data = rmmap.mmap(fd, 0, access=rmmap.ACCESS_READ)
+    except (rmmap.RValueError, rmmap.RTypeError):
+      raise OSError(0, 'cannot map file')
+    try:
+      if width == 0:
+        return read_text(data, numeric)
+      return read_binary(data, width, numeric)
+    finally:
+      data.close()
+  finally:
+    os.close(fd)
+
+def make_value(numeric, n):
+  if 0 <= n < 16:
+    return numeric.digits[n]
+  return numeric.fromint(n)
+
+def read_text(data, numeric):
+  values = rdeque()
+  size = data.len()
+  i = 0
+  while i < size:
+    if data.getitem(i).isspace():
+      i += 1
+      continue
+    start = i
+    while i < size and not data.getitem(i).isspace():
+      i += 1
+    values.append(read_token(data, start, i, numeric))
+  return values
+
+def read_token(data, start, end, numeric):
+  """Parses one number, reading word-sized integers in place."""
+  i = start
+  negative = False
+  c = data.getitem(i)
+  if c == '-' or c == '+':
+    negative = c == '-'
+    i += 1
+  if 0 < end - i <= MAX_DIGITS:
+    n = 0
+    while i < end:
+      c = data.getitem(i)
+      if not '0' <= c <= '9':
+        break
+      n = n * 10 + (ord(c) - ord('0'))
+      i += 1
+    if i == end:
+      if negative:
+        n = -n
+      return make_value(numeric, n)
+  return numeric.fromstr(data.getslice(start, end - start))
+
+def read_binary(data, width, numeric):
+  """Reads `width` byte integers straight into unboxed storage."""
+  size = data.len()
+  if size % width != 0:
+    raise ValueError('truncated integer')
+  n = size // width
+  if not numeric.digits[0].isword():
+    values = rdeque()
+    for k in range(n):
+      values.append(make_value(numeric, read_word(data, k, width)))
+    return values
+  strategy = numeric.words
+  storage = strategy.allocate(capacity_for(n))
+  words = strategy.unerase(storage)
+  for k in range(n):
+    words[k] = read_word(data, k, width)
+  return rdeque.fromstorage(strategy, storage, n)
+
+def read_word(data, k, width):
+  sign = r_uint(1) << (width * 8 - 1)
+  u = r_uint(0)
+  for j in range(width - 1, -1, -1):
+    u = (u << 8) | r_uint(ord(data.getitem(k * width + j)))
+  if u & sign:
+    u |= ~((sign << 1) - 1)
+  return intmask(u)
@@ -0,0 +1,139 @@
+import errno
+import os
+
+from rpython.rlib.rstring import StringBuilder
+
+from rsignals import Interrupted, stop_requested
+
+DEFAULT_BUFFER_SIZE = 65536
+
+
+def write_all(fd, data):
+  """Writes all of `data`, retrying a write interrupted by a signal."""
+  while data:
+    try:
+      n = os.write(fd, data)
+    except OSError as e:
+      if e.errno != errno.EINTR:
+        raise
+      continue
+    data = data[n:]
+
+
+class rwriter(object):
+  """Buffers output to `fd` until `size` bytes are pending."""
+  __slots__ = ['fd', 'size', 'builder', 'pending']
+
+  def __init__(self, fd, size = DEFAULT_BUFFER_SIZE):
+    self.fd = fd
+    self.size = size
+    self.builder = StringBuilder()
+    self.pending = 0
+
+  @staticmethod
+  def inmemory():
+    return rwriter(-1, 0)
+
+  def write(self, data):
+    if self.size <= 0 and self.fd >= 0:
+      write_all(self.fd, data)
+      return
+    self.builder.append(data)
+    self.pending += len(data)
+    if self.pending >= self.size and self.fd >= 0:
+      self.flush()
+
+  def getvalue(self):
+    return self.builder.build()
+
+  def flush(self):
+    if self.pending > 0 and self.fd >= 0:
+      data = self.builder.build()
+      self.builder = StringBuilder()
+      self.pending = 0
+      write_all(self.fd, data)
+
+
+class rreader(object):
+  """Reads from `fd` a block at a time, or a line in line buffered mode."""
+  __slots__ = ['fd', 'size', 'line_buffered', 'buf', 'pos', 'record']
+
+  def __init__(self, fd, size = DEFAULT_BUFFER_SIZE, line_buffered = False):
+    self.fd = fd
+    self.size = size
+    self.line_buffered = line_buffered
+    self.buf = ''
+    self.pos = 0
+    self.record = None
+
+  @staticmethod
+  def frombytes(data):
+    reader = rreader(-1)
+    reader.buf = data
+    return reader
+
+  def fill(self):
+    if self.fd < 0:
+      self.buf = ''
+    elif self.line_buffered:
+      builder = StringBuilder()
+      while True:
+        char = self.read_fd(1)
+        if not char:
+          break
+        builder.append(char)
+        if char[0] == '\n':
+          break
+      self.buf = builder.build()
+    else:
+      self.buf = self.read_fd(self.size)
+    self.pos = 0
+    return len(self.buf) > 0
+
+  def read_fd(self, n):
+    while True:
+      try:
+        return os.read(self.fd, n)
+      except OSError as e:
+        if e.errno != errno.EINTR:
+          raise
+        if stop_requested():
+          raise Interrupted
+
+  def read_byte(self):
+    """Returns the next byte of input, or -1 at end of file."""
+    if self.pos >= len(self.buf) and not self.fill():
+      return -1
+    char = self.buf[self.pos]
+    self.pos += 1
+    if self.record is not None:
+      self.record.write(char)
+    return ord(char)
+
+  def read(self, n):
+    """Returns the next n bytes of input, or fewer at end of file."""
+    builder = StringBuilder()
+    while n > 0:
+      if self.pos >= len(self.buf) and not self.fill():
+        break
+      end = min(len(self.buf), self.pos + n)
+      builder.append_slice(self.buf, self.pos, end)
+      n -= end - self.pos
+      self.pos = end
+    return builder.build()
+
+  def read_line(self):
+    """Returns the next line without its newline, or None at the end."""
+    builder = StringBuilder()
+    n = 0
+    while True:
+      char = self.read_byte()
+      if char < 0:
+        if n == 0:
+          return None
+        break
+      if char == 10:
+        break
+      builder.append(chr(char))
+      n += 1
+    return builder.build()
@@ -0,0 +1,150 @@
+from rpython.rlib import rerased
+
+
+class rstorage(object):
+  """How an `rdeque` holds its items."""
+  _immutable_fields_ = ['numeric']
+
+  def __init__(self, numeric):
+    self.numeric = numeric
+
+  def clearitem(self, storage, i):
+    """Drops the reference held by a slot which is no longer used."""
+    pass
+
+  def copy(self, source, start, n, mask, capacity):
+    """New storage of `capacity` slots, holding n slots of `source`."""
+    storage = self.allocate(capacity)
+    for i in range(n):
+      self.moveitem(source, (start + i) & mask, storage, i)
+    return storage
+
+  def convert(self, strategy, source, start, n, mask):
+    """Storage of this strategy with the items of `source`."""
+    storage = self.allocate(mask + 1)
+    for i in range(n):
+      j = (start + i) & mask
+      self.setitem(storage, j, strategy.getitem(source, j))
+    return storage
+
+
+def specialized(value):
+  """The narrowest strategy which holds `value`."""
+  numeric = value.numeric()
+  if value.isword():
+    return numeric.words
+  if value.tobig() is not None:
+    return numeric.bigs
+  return OBJECTS
+
+
+class rempty(rstorage):
+  """No storage at all, for a deque which has not yet held a value."""
+  erase, unerase = rerased.new_erasing_pair('empty')
+  erase = staticmethod(erase)
+  unerase = staticmethod(unerase)
+
+  def allocate(self, capacity):
+    return self.erase(None)
+
+  def fits(self, value):
+    return False
+
+  def generalized(self, value):
+    return specialized(value)
+
+  def getitem(self, storage, i):
+    raise IndexError('no slots')
+
+  def setitem(self, storage, i, value):
+    raise IndexError('no slots')
+
+  def moveitem(self, source, i, storage, j):
+    pass
+
+
+class rwords(rstorage):
+  """Integers which fit in a machine word, unboxed."""
+  erase, unerase = rerased.new_erasing_pair('words')
+  erase = staticmethod(erase)
+  unerase = staticmethod(unerase)
+
+  def allocate(self, capacity):
+    return self.erase([0] * capacity)
+
+  def fits(self, value):
+    return value.isword()
+
+  def generalized(self, value):
+    if value.tobig() is not None:
+      return self.numeric.bigs
+    return OBJECTS
+
+  def getitem(self, storage, i):
+    return self.numeric.fromint(self.unerase(storage)[i])
+
+  def setitem(self, storage, i, value):
+    self.unerase(storage)[i] = value.toint()
+
+  def moveitem(self, source, i, storage, j):
+    self.unerase(storage)[j] = self.unerase(source)[i]
+
+
+class rbigs(rstorage):
+  """Integers of any size, as unboxed rbigints."""
+  erase, unerase = rerased.new_erasing_pair('bigs')
+  erase = staticmethod(erase)
+  unerase = staticmethod(unerase)
+
+  def allocate(self, capacity):
+    return self.erase([None] * capacity)
+
+  def fits(self, value):
+    return value.tobig() is not None
+
+  def generalized(self, value):
+    return OBJECTS
+
+  def getitem(self, storage, i):
+    return self.numeric.frombig(self.unerase(storage)[i])
+
+  def setitem(self, storage, i, value):
+    self.unerase(storage)[i] = value.tobig()
+
+  def clearitem(self, storage, i):
+    self.unerase(storage)[i] = None
+
+  def moveitem(self, source, i, storage, j):
+    self.unerase(storage)[j] = self.unerase(source)[i]
+
+
+class robjects(rstorage):
+  """Any values, boxed."""
+  erase, unerase = rerased.new_erasing_pair('objects')
+  erase = staticmethod(erase)
+  unerase = staticmethod(unerase)
+
+  def allocate(self, capacity):
+    return self.erase([None] * capacity)
+
+  def fits(self, value):
+    return True
+
+  def generalized(self, value):
+    return self
+
+  def getitem(self, storage, i):
+    return self.unerase(storage)[i]
+
+  def setitem(self, storage, i, value):
+    self.unerase(storage)[i] = value
+
+  def clearitem(self, storage, i):
+    self.unerase(storage)[i] = None
+
+  def moveitem(self, source, i, storage, j):
+    self.unerase(storage)[j] = self.unerase(source)[i]
+
+
+EMPTY = rempty(None)
+OBJECTS = robjects(None)
@@ -0,0 +1,125 @@
+from rprofile import direction, rjust, symbol, ARROWS
+from rstorage import rbigs, rwords
+
+FIELDS = 9
+TOP_NONE, TOP_WORD, TOP_BIG, TOP_BOXED = range(4)
+MAX_VALUES = 64
+
+
+def error_name(e):
+  if isinstance(e, IndexError):
+    return 'IndexError'
+  if isinstance(e, ZeroDivisionError):
+    return 'ZeroDivisionError'
+  if isinstance(e, OverflowError):
+    return 'OverflowError'
+  if isinstance(e, UnicodeDecodeError):
+    return 'UnicodeDecodeError'
+  if isinstance(e, ValueError):
+    return 'ValueError'
+  if isinstance(e, MemoryError):
+    return 'MemoryError'
+  if isinstance(e, RuntimeError):
+    return 'RuntimeError'
+  if isinstance(e, OSError):
+    return 'OSError'
+  return 'Exception'
+
+
+class rtrace(object):
+  """A ring buffer of the last `size` steps or block ops, as rows of ints."""
+  __slots__ = ['size', 'count', 'entries', 'tops', 'bigs', 'stack']
+
+  def __init__(self):
+    self.size = 0
+    self.count = 0
+    self.entries = []
+    self.tops = []
+    self.bigs = []
+    self.stack = None
+
+  def enable(self, size):
+    """Keeps at least the last `size` entries."""
+    self.size = 1
+    while self.size < size:
+      self.size <<= 1
+    self.entries = [0] * (self.size * FIELDS)
+    self.tops = [None] * self.size
+    self.bigs = [None] * self.size
+
+  def start(self, stack):
+    """Forgets the entries of the previous run, which runs on `stack`."""
+    self.count = 0
+    self.stack = stack
+
+  def step(self, x, y, dx, dy, code, stack, frames):
+    i = self.count & (self.size - 1)
+    self.count += 1
+    j = i * FIELDS
+    depth = stack.len()
+    entries = self.entries
+    entries[j] = stack.steps
+    entries[j + 1] = x
+    entries[j + 2] = y
+    entries[j + 3] = direction(dx, dy)
+    entries[j + 4] = code
+    entries[j + 5] = depth
+    entries[j + 6] = frames
+    if depth > 0:
+      self.top(i, j, stack)
+    else:
+      entries[j + 7] = TOP_NONE
+
+  def top(self, i, j, stack):
+    """Records the top of the stack as it is held, without boxing it."""
+    entries = self.entries
+    if stack.depth > 0:
+      entries[j + 7] = TOP_BOXED
+      self.tops[i] = stack.window[stack.depth - 1]
+      return
+    deque = stack.deque
+    strategy = deque.strategy
+    slot = deque.index(deque.len() - 1)
+    if isinstance(strategy, rwords):
+      entries[j + 7] = TOP_WORD
+      entries[j + 8] = strategy.unerase(deque.storage)[slot]
+    elif isinstance(strategy, rbigs):
+      entries[j + 7] = TOP_BIG
+      self.bigs[i] = strategy.unerase(deque.storage)[slot]
+    else:
+      entries[j + 7] = TOP_BOXED
+      self.tops[i] = deque.top()
+
+  def report(self, name, error, steps):
+    """Formats the entries, the oldest first, and the stack at `error`."""
+    n = min(self.count, self.size)
+    lines = ['trace of %s: %s after %d steps' % (name, error, steps),
+             '        step       x       y  dir  op   depth  frames  top']
+    for k in range(self.count - n, self.count):
+      i = k & (self.size - 1)
+      j = i * FIELDS
+      entries = self.entries
+      line = (rjust('%d' % entries[j], 12) + rjust('%d' % entries[j + 1], 8) + rjust('%d' % entries[j + 2], 8) +
+              '    ' + ARROWS[entries[j + 3]] + '  ' + symbol(entries[j + 4]) +
+              rjust('%d' % entries[j + 5], 8) + rjust('%d' % entries[j + 6], 8))
+      tag = entries[j + 7]
+      if tag == TOP_WORD:
+        line += '  %d' % entries[j + 8]
+      elif tag == TOP_BIG:
+        line += '  ' + self.bigs[i].str()
+      elif tag == TOP_BOXED:
+        line += '  ' + self.tops[i].tostr()
+      lines.append(line)
+    stack = self.stack
+    if stack is not None:
+      frames = stack.frames()
+      current = frames[len(frames) - 1]
+      lines.append('stack (depth %d, %d enclosing frames), the top last:' % (len(current), len(frames) - 1))
+      start = max(len(current) - MAX_VALUES, 0)
+      if start > 0:
+        lines.append('  ... %d more' % start)
+      if current:
+        values = [current[v].tostr() for v in range(start, len(current))]
+        lines.append('  ' + ' '.join(values))
+    lines.append('')
+    return '\n'.join(lines)